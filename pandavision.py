@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import os
+import sys
 import json
 import requests
 import argparse
@@ -9,16 +10,40 @@ import typing
 import datetime
 import time
 import tabulate
-import copy
-
-from rucio.client import Client
-
+import collections
+import threading
+import queue
+import urllib.parse
+import urllib3
+import concurrent.futures
+import sqlite3
+import codecs
+import contextlib
+import shlex
+import itertools
+import subprocess
+import http.server
+import http.client
+import socket
+import socketserver
+import zlib
+import numpy as np
+
+if typing.TYPE_CHECKING:
+  from rucio.client import Client
+
+
+BIGPANDA_URL = 'https://bigpanda.cern.ch'
 
 JSON_HEADERS = {
   'Accept'       : 'application/json',
   'Content-Type' : 'application/json',
 }
 
+# job and task statuses after which the records returned by bigpanda no longer change
+JOB_FINAL_STATUSES = [ 'failed', 'finished' ]
+TASK_FINAL_STATUSES = [ 'aborted', 'broken', 'done', 'failed', 'finished' ]
+
 # statuses not listed in the following: (activated?), assigning, exhausted, paused, ready, registered, running, submitting, scouting, (starting?), staged
 STATUSES = [ 'aborted', 'broken', 'done', 'failed', 'finished', 'pending', 'running' ]
 
@@ -33,6 +58,63 @@ ANSI_COLORS = {
 }
 ANSI_BOLD = '\033[1m'
 
+# upper limit on the number of requests that are in flight to the same host at any given time
+MAX_REQUESTS_PER_HOST = 4
+HTTP_TIMEOUT = 60 # in seconds
+HTTP_RETRIES = 5
+HTTP_BACKOFF = 1. # in seconds, doubles with every retry
+HTTP_RETRY_STATUSES = [ 429, 500, 502, 503, 504 ]
+HTTP_RATE = 20. # requests per second, zero disables rate limiting
+
+# number of file DIDs that are resolved with a single list_replicas call
+REPLICA_BATCH_SIZE = 1000
+REPLICA_TTL = 3600 # in seconds, how long dataset contents and replica sites are kept in the response cache
+REPLICA_MEMO_SIZE = 100000 # number of files whose replica sites are kept in memory
+DATASET_MEMO_SIZE = 1000 # number of datasets whose file lists are kept in memory
+# both memos hold (time stored, value) and expire after REPLICA_TTL like the cached copies, which matters for the
+# long-running watch and daemon modes
+DATASET_FILES = collections.OrderedDict()
+REPLICA_SITES = collections.OrderedDict()
+DATASET_INFO_LOCK = threading.Lock()
+
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_PER_RSE = 2 # number of files downloaded at once from the same RSE
+DOWNLOAD_SCHEMES = [ 'davs', 'https', 'http' ] # the replica protocols that can be downloaded over plain HTTP
+DOWNLOAD_CHUNK_SIZE = 1024**2
+
+# options that can differ between the queries of a batch, the remaining ones are shared by all queries
+QUERY_OPTIONS = [ 'user', 'contains', 'status_include', 'status_exclude', 'days', 'task_id' ]
+
+# the daemon listens on a Unix socket that only its user can connect to, so that nobody else gets the answers for its
+# CRIC identity and a user never gets those of somebody else's daemon
+DAEMON_SOCKET = os.path.join(
+  os.getenv('XDG_RUNTIME_DIR') or os.path.join(os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'pandavision'),
+  'pandavision.sock',
+)
+DAEMON_CONNECT_TIMEOUT = 1 # in seconds
+DAEMON_REFRESH = 300 # in seconds, how often the daemon reruns the queries it has been asked for
+DAEMON_IDLE_TIME = 3600 # in seconds, queries that have not been asked for this long are no longer refreshed
+DAEMON_OPTIONS = QUERY_OPTIONS + [ 'show_files', 'no_datasets', 'compact', 'max_chains' ]
+DAEMON_CLIENT_OPTIONS = [ 'output', 'daemon_socket', 'no_daemon' ] # options that only concern the client of a daemon
+
+# maximum number of tasks or jobs requested at once; if a response is full, the query is split into smaller time windows
+PAGE_SIZE = 10000
+PIPELINE_DEPTH = 2 # number of tasks by which a stage of the task pipeline may run ahead of the next stage
+PIPELINE_POLL_INTERVAL = 0.1 # in seconds, how often the blocked stages of the task pipeline check whether to stop
+STREAM_CHUNK_SIZE = 64 * 1024
+
+CACHE_PATH = os.path.join(os.getenv('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'pandavision', 'cache.sqlite')
+CACHE_TTL = 300 # in seconds, applies to records that may still change
+CACHE_MAX_SIZE = 512 # in MB
+CACHE_CHUNK_SIZE = 10000 # number of records of a listing that are stored in the response cache together
+CACHE = None
+
+HISTORY_PATH = os.path.join(os.path.dirname(CACHE_PATH), 'history.sqlite')
+HISTORY = None
+
+OUTPUT_MODES = [ 'text', 'ndjson' ]
+OUTPUT_BUFFER_SIZE = 64 * 1024 # the report is written in chunks of this many characters
+
 PANDA_NO_ERROR = ''
 PANDA_ERRORS = {
   'ddm:200'           : 'Expected output *.log.tgz is missing in pilot JSON',
@@ -65,18 +147,384 @@ def boldify(text: str) -> str:
   return ANSI_BOLD + text + ANSI_RESET
 
 
+class ResponseCache:
+  def __init__(self, path: str, max_size: int = CACHE_MAX_SIZE, refresh: bool = False):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    self.max_bytes = max_size * 1024**2
+    self.refresh = refresh
+    self.lock = threading.Lock()
+    self.db = sqlite3.connect(path, check_same_thread = False)
+    self.db.execute('PRAGMA journal_mode = WAL')
+    self.db.execute('PRAGMA synchronous = NORMAL')
+    self.db.execute(
+      'CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, expires REAL, accessed REAL, size INTEGER)'
+    )
+    self.total_bytes = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+  @staticmethod
+  def make_key(url: str, params: dict, tag: str = '') -> str:
+    key = f'{url}?{urllib.parse.urlencode(sorted(params.items()))}'
+    return f'{key}#{tag}' if tag else key
+
+  def get(self, key: str) -> typing.Optional[dict]:
+    if self.refresh:
+      return None
+    now = time.time()
+    with self.lock:
+      row = self.db.execute('SELECT value, expires FROM responses WHERE key = ?', (key,)).fetchone()
+      if row is None:
+        return None
+      value, expires = row
+      if expires is not None and expires < now:
+        return None
+      self.db.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+      self.db.commit()
+    return json.loads(value)
+
+  def contains(self, keys: typing.List[str]) -> bool:
+    # whether all of the records are present and have not expired
+    if self.refresh:
+      return False
+    with self.lock:
+      num_found = 0
+      for key_start in range(0, len(keys), 500):
+        key_batch = keys[key_start:key_start + 500]
+        num_found += self.db.execute(
+          f'SELECT COUNT(*) FROM responses WHERE key IN ({", ".join("?" * len(key_batch))}) AND (expires IS NULL OR expires >= ?)',
+          (*key_batch, time.time()),
+        ).fetchone()[0]
+    return num_found == len(keys)
+
+  def get_many(self, keys: typing.List[str]) -> dict:
+    return { key : data for key in keys if (data := self.get(key)) is not None }
+
+  def put(self, key: str, data: dict, ttl: typing.Optional[int]) -> None:
+    self.put_many({ key : data }, ttl)
+
+  def put_many(self, items: dict, ttl: typing.Optional[int]) -> None:
+    # records without TTL never expire and are removed only when the cache runs out of space
+    now = time.time()
+    expires = None if ttl is None else now + ttl
+    with self.lock:
+      for key, data in items.items():
+        value = json.dumps(data)
+        row = self.db.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+          self.total_bytes -= row[0]
+        self.db.execute(
+          'INSERT OR REPLACE INTO responses (key, value, expires, accessed, size) VALUES (?, ?, ?, ?, ?)',
+          (key, value, expires, now, len(value)),
+        )
+        self.total_bytes += len(value)
+      self.evict()
+      self.db.commit()
+
+  def evict(self) -> None:
+    # expired records go first, then the least recently used ones until the cache fits into its size limit
+    if self.total_bytes <= self.max_bytes:
+      return
+    self.db.execute('DELETE FROM responses WHERE expires IS NOT NULL AND expires < ?', (time.time(),))
+    self.total_bytes = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+    while self.total_bytes > self.max_bytes:
+      rows = self.db.execute('SELECT key, size FROM responses ORDER BY accessed LIMIT 100').fetchall()
+      if not rows:
+        break
+      for key, size in rows:
+        self.db.execute('DELETE FROM responses WHERE key = ?', (key,))
+        self.total_bytes -= size
+        if self.total_bytes <= self.max_bytes:
+          break
+
+  def close(self) -> None:
+    with self.lock:
+      self.db.commit()
+      self.db.close()
+
+
+class Profiler:
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.endpoints = {}
+    self.phases = {}
+    self.background_phases = {}
+    self.phase_stack = threading.local()
+    self.start_time = time.perf_counter()
+
+  @staticmethod
+  def get_endpoint(url: str) -> str:
+    url_split = urllib.parse.urlsplit(url)
+    return url_split.netloc + url_split.path.rstrip('/')
+
+  def get_stats(self, endpoint: str) -> dict:
+    if endpoint not in self.endpoints:
+      self.endpoints[endpoint] = { 'calls' : 0, 'cache_hits' : 0, 'bytes' : 0, 'latencies' : [] }
+    return self.endpoints[endpoint]
+
+  @contextlib.contextmanager
+  def call(self, endpoint: str) -> typing.Iterator[None]:
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      latency = time.perf_counter() - start
+      with self.lock:
+        stats = self.get_stats(endpoint)
+        stats['calls'] += 1
+        stats['latencies'].append(latency)
+
+  def add_bytes(self, endpoint: str, num_bytes: int) -> None:
+    with self.lock:
+      self.get_stats(endpoint)['bytes'] += num_bytes
+
+  def add_cache_hit(self, endpoint: str) -> None:
+    with self.lock:
+      self.get_stats(endpoint)['cache_hits'] += 1
+
+  def count(self, endpoint: str) -> int:
+    with self.lock:
+      return self.endpoints[endpoint]['calls'] if endpoint in self.endpoints else 0
+
+  @contextlib.contextmanager
+  def phase(self, name: str) -> typing.Iterator[None]:
+    # the time spent in a nested phase is not counted towards the enclosing phase
+    stack = self.phase_stack.__dict__.setdefault('stack', [])
+    now = time.perf_counter()
+    if stack:
+      self.add_phase_time(stack[-1][0], now - stack[-1][1])
+    stack.append([ name, now ])
+    try:
+      yield
+    finally:
+      now = time.perf_counter()
+      self.add_phase_time(name, now - stack.pop()[1])
+      if stack:
+        stack[-1][1] = now
+
+  def iter_phase(self, name: str, iterable: typing.Iterable) -> typing.Iterator:
+    # attributes only the time spent in producing the items to the phase, not the time spent in consuming them
+    iterator = iter(iterable)
+    sentinel = object()
+    while True:
+      with self.phase(name):
+        item = next(iterator, sentinel)
+      if item is sentinel:
+        return
+      yield item
+
+  def add_phase_time(self, name: str, elapsed: float) -> None:
+    # phases of other threads overlap those of the main thread, hence they are kept apart to not count time twice
+    phases = self.phases if threading.current_thread() is threading.main_thread() else self.background_phases
+    with self.lock:
+      phases[name] = phases.get(name, 0.) + elapsed
+
+  def report(self) -> dict:
+    def percentile(values: typing.List[float], q: float) -> float:
+      return values[min(len(values) - 1, int(round(q * (len(values) - 1))))] if values else 0.
+
+    with self.lock:
+      endpoints = {}
+      for endpoint, stats in self.endpoints.items():
+        latencies = list(sorted(stats['latencies']))
+        endpoints[endpoint] = {
+          'calls'      : stats['calls'],
+          'cache_hits' : stats['cache_hits'],
+          'bytes'      : stats['bytes'],
+          'p50'        : percentile(latencies, 0.5),
+          'p95'        : percentile(latencies, 0.95),
+          'max'        : latencies[-1] if latencies else 0.,
+          'total'      : sum(latencies),
+        }
+      return {
+        'wall_time'         : time.perf_counter() - self.start_time,
+        'endpoints'         : endpoints,
+        'phases'            : dict(self.phases),
+        'background_phases' : dict(self.background_phases),
+      }
+
+
+PROFILER = Profiler()
+
+
+class TokenBucket:
+  def __init__(self, rate: float, capacity: float):
+    self.rate = rate
+    self.capacity = capacity
+    self.tokens = capacity
+    self.updated = time.monotonic()
+    self.lock = threading.Lock()
+
+  def acquire(self) -> None:
+    if self.rate <= 0:
+      return
+    with self.lock:
+      now = time.monotonic()
+      self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+      self.updated = now
+      # the token is reserved right away, so concurrent callers queue up behind each other
+      self.tokens -= 1
+      wait = -self.tokens / self.rate if self.tokens < 0 else 0
+    if wait > 0:
+      time.sleep(wait)
+
+
+class Transport:
+  def __init__(
+        self,
+        timeout: float = HTTP_TIMEOUT,
+        retries: int = HTTP_RETRIES,
+        rate: float = HTTP_RATE,
+        max_per_host: int = MAX_REQUESTS_PER_HOST,
+      ):
+    self.timeout = timeout
+    self.rate_limiter = TokenBucket(rate, max(rate, 1.))
+    retry = urllib3.util.Retry(
+      total = retries,
+      backoff_factor = HTTP_BACKOFF,
+      status_forcelist = HTTP_RETRY_STATUSES,
+      allowed_methods = [ 'GET' ],
+      respect_retry_after_header = True,
+      raise_on_status = False,
+    )
+    # a blocking pool caps the number of concurrent connections, and hence requests, per host
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize = max_per_host, pool_block = True, max_retries = retry)
+    self.session = requests.Session()
+    self.session.headers['Accept-Encoding'] = 'gzip, deflate'
+    self.session.mount('https://', adapter)
+    self.session.mount('http://', adapter)
+
+  def get(self, url: str, endpoint: typing.Optional[str] = None, **kwargs) -> requests.Response:
+    kwargs.setdefault('timeout', self.timeout)
+    self.rate_limiter.acquire()
+    endpoint = endpoint or Profiler.get_endpoint(url)
+    with PROFILER.call(endpoint):
+      r = self.session.get(url, **kwargs)
+    if not kwargs.get('stream'):
+      PROFILER.add_bytes(endpoint, len(r.content))
+    return r
+
+
+TRANSPORT = Transport()
+
+
+class Output:
+  def __init__(self, mode: str = 'text', buffer_size: int = OUTPUT_BUFFER_SIZE):
+    # in the NDJSON mode the records go to stdout and the human-readable report goes to stderr
+    self.mode = mode
+    self.lock = threading.Lock()
+    # the report lines are collected and written in large chunks, which is much cheaper than a write per line
+    self.buffer_size = buffer_size
+    self.buffer = []
+    self.buffered = 0
+
+  def text(self, *args) -> None:
+    line = ' '.join(str(arg) for arg in args) + '\n'
+    with self.lock:
+      self.buffer.append(line)
+      self.buffered += len(line)
+      if self.buffered >= self.buffer_size:
+        self.write_buffer()
+
+  def write_buffer(self) -> None:
+    stream = sys.stdout if self.mode == 'text' else sys.stderr
+    stream.write(''.join(self.buffer))
+    self.buffer = []
+    self.buffered = 0
+
+  def flush(self) -> None:
+    # called at the end of every block of the report, so that it appears progressively while the chunked writes
+    # within a block stay cheap
+    with self.lock:
+      self.write_buffer()
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+  def record(self, kind: str, data: dict) -> None:
+    if self.mode != 'ndjson':
+      return
+    with self.lock:
+      sys.stdout.write(json.dumps({ 'type' : kind, **data }) + '\n')
+      sys.stdout.flush()
+
+
+OUTPUT = Output()
+
+
+class CaptureOutput(Output):
+  # keeps the report and the records in memory, so that the daemon can return them to its clients
+  def __init__(self):
+    super().__init__('ndjson')
+    self.lines = []
+    self.records = []
+
+  def write_buffer(self) -> None:
+    self.lines.extend(self.buffer)
+    self.buffer = []
+    self.buffered = 0
+
+  def record(self, kind: str, data: dict) -> None:
+    with self.lock:
+      self.records.append({ 'type' : kind, **data })
+
+  def report(self) -> str:
+    with self.lock:
+      self.write_buffer()
+      return ''.join(self.lines)
+
+
+class LazyRucioClient:
+  def __init__(self):
+    # rucio is slow to import and to connect, so both are deferred until the first Rucio call
+    self.client = None
+    self.lock = threading.Lock()
+
+  def __getattr__(self, name: str) -> typing.Any:
+    with self.lock:
+      if self.client is None:
+        from rucio.client import Client
+        self.client = Client()
+    return getattr(self.client, name)
+
+
+def get_proxy_info(cert: str) -> dict:
+  # the SHA-256 fingerprint identifies the proxy and notAfter tells until when the CRIC name can be cached
+  try:
+    r = subprocess.run(
+      [ 'openssl', 'x509', '-in', cert, '-noout', '-fingerprint', '-sha256', '-enddate' ],
+      capture_output = True, text = True, check = True,
+    )
+  except (OSError, subprocess.CalledProcessError):
+    return {}
+  proxy_info = {}
+  for line in r.stdout.splitlines():
+    if 'Fingerprint=' in line:
+      proxy_info['fingerprint'] = line.split('=', 1)[1].replace(':', '').lower()
+    elif line.startswith('notAfter='):
+      not_after = datetime.datetime.strptime(line.split('=', 1)[1], '%b %d %H:%M:%S %Y %Z')
+      proxy_info['expires'] = not_after.replace(tzinfo = datetime.timezone.utc).timestamp()
+  return proxy_info if len(proxy_info) == 2 else {}
+
+
 def get_CRIC_name() -> str:
   capath = os.getenv('X509_CERT_DIR')
   cert = os.getenv('X509_USER_PROXY')
   key = cert
+  proxy_info = get_proxy_info(cert) if CACHE and cert else {}
+  cache_key = f'cric:whoami#{proxy_info["fingerprint"]}' if proxy_info else ''
+  if cache_key:
+    name = CACHE.get(cache_key)
+    if name is not None:
+      PROFILER.add_cache_hit('cric:whoami')
+      return name
   url = 'https://cms-cric.cern.ch/api/accounts/user/query'
   params = {
     'json'   : True,
     'preset' : 'whoami',
   }
-  r = requests.get(url, verify = capath, cert = (cert, key), params = params)
+  r = TRANSPORT.get(url, verify = capath, cert = (cert, key), params = params)
   j = json.loads(r.text)
   name = j['result'][0]['name'] # for username use 'login'
+  if cache_key:
+    CACHE.put(cache_key, name, int(proxy_info['expires'] - time.time()))
   return name
 
 
@@ -89,50 +537,360 @@ def get_json_request(r) -> dict:
       try:
         data = r.json()
       except ValueError:
-        print('Response is not valid JSON')
+        OUTPUT.text('Response is not valid JSON')
+    else:
+      OUTPUT.text('Unexpected Content-Type:', content_type)
+  except requests.exceptions.HTTPError as err:
+    OUTPUT.text('HTTP error occurred:', err)
+  except requests.exceptions.RequestException as err:
+    OUTPUT.text('Request error occurred:', err)
+  return data
+
+
+class JSONStream:
+  def __init__(self, chunks: typing.Iterable[bytes]):
+    self.chunks = iter(chunks)
+    self.utf8 = codecs.getincrementaldecoder('utf-8')()
+    self.decoder = json.JSONDecoder()
+    self.buffer = ''
+    self.pos = 0
+    self.exhausted = False
+
+  def fill(self, size: int) -> None:
+    while not self.exhausted and len(self.buffer) - self.pos < size:
+      chunk = next(self.chunks, None)
+      self.buffer = self.buffer[self.pos:]
+      self.pos = 0
+      if chunk is None:
+        self.buffer += self.utf8.decode(b'', final = True)
+        self.exhausted = True
+      else:
+        self.buffer += self.utf8.decode(chunk)
+
+  def peek(self) -> str:
+    while True:
+      while self.pos < len(self.buffer) and self.buffer[self.pos].isspace():
+        self.pos += 1
+      if self.pos < len(self.buffer) or self.exhausted:
+        return self.buffer[self.pos:self.pos + 1]
+      self.fill(1)
+
+  def expect(self, char: str) -> None:
+    if self.peek() != char:
+      raise ValueError(f'Expected {char!r} at position {self.pos}')
+    self.pos += 1
+
+  def value(self) -> typing.Any:
+    self.peek()
+    while True:
+      try:
+        obj, end = self.decoder.raw_decode(self.buffer, self.pos)
+        # a number at the very end of the buffer may continue in the next chunk
+        if end < len(self.buffer) or self.exhausted:
+          self.pos = end
+          return obj
+      except json.JSONDecodeError:
+        if self.exhausted:
+          raise
+      # the amount of buffered data is doubled every time so that large values are not rescanned too many times
+      self.fill(2 * (len(self.buffer) - self.pos))
+
+  def iter_array(self) -> typing.Iterator[typing.Any]:
+    self.expect('[')
+    if self.peek() == ']':
+      self.pos += 1
+      return
+    while True:
+      yield self.value()
+      if self.peek() == ']':
+        self.pos += 1
+        return
+      self.expect(',')
+
+  def iter_records(self, stream_key: typing.Optional[str] = None) -> typing.Iterator[typing.Tuple[typing.Optional[str], typing.Any]]:
+    # yields the elements of a top-level array, or the elements of the array stored under stream_key of a top-level
+    # object together with the remaining key-value pairs of that object
+    if self.peek() == '[':
+      for item in self.iter_array():
+        yield None, item
+      return
+    self.expect('{')
+    if self.peek() == '}':
+      return
+    while True:
+      key = self.value()
+      self.expect(':')
+      if key == stream_key and self.peek() == '[':
+        for item in self.iter_array():
+          yield key, item
+      else:
+        yield key, self.value()
+      if self.peek() == '}':
+        return
+      self.expect(',')
+
+
+def count_bytes(chunks: typing.Iterable[bytes], url: str) -> typing.Iterator[bytes]:
+  endpoint = Profiler.get_endpoint(url)
+  for chunk in chunks:
+    PROFILER.add_bytes(endpoint, len(chunk))
+    yield chunk
+
+
+class IncompleteResponse(RuntimeError):
+  # raised after the error has been reported, so that a listing that broke off is neither cached nor stored as complete
+  pass
+
+
+def iter_json_request(r, stream_key: typing.Optional[str] = None) -> typing.Iterator[typing.Tuple[typing.Optional[str], typing.Any]]:
+  error = ''
+  try:
+    r.raise_for_status()
+    content_type = r.headers.get('Content-Type')
+    if 'application/json' in content_type:
+      try:
+        yield from JSONStream(count_bytes(r.iter_content(chunk_size = STREAM_CHUNK_SIZE), r.url)).iter_records(stream_key)
+      except ValueError:
+        error = 'Response is not valid JSON'
     else:
-      print('Unexpected Content-Type:', content_type)
+      error = f'Unexpected Content-Type: {content_type}'
   except requests.exceptions.HTTPError as err:
-    print('HTTP error occurred:', err)
+    error = f'HTTP error occurred: {err}'
   except requests.exceptions.RequestException as err:
-    print('Request error occurred:', err)
+    # this includes a response that breaks off in the middle
+    error = f'Request error occurred: {err}'
+  finally:
+    r.close()
+  if error:
+    OUTPUT.text(error)
+    raise IncompleteResponse(error)
+
+
+def iter_pages(
+      url: str,
+      params: dict,
+      stream_key: typing.Optional[str],
+      id_key: str,
+      date_from: datetime.date,
+      date_to: datetime.date,
+      page_size: int = PAGE_SIZE,
+    ) -> typing.Iterator[typing.Tuple[typing.Optional[str], typing.Any]]:
+  # bigpanda has no offset-based paging, so a full response is refetched as two halves of its time window
+  seen = set()
+  windows = [ None ]
+  while windows:
+    window = windows.pop(0)
+    page_params = dict(params, limit = page_size)
+    if window:
+      page_params.pop('days', None)
+      page_params['date_from'] = window[0].isoformat()
+      page_params['date_to'] = window[1].isoformat()
+    r = TRANSPORT.get(url, params = page_params, headers = JSON_HEADERS, stream = True)
+    num_records = 0
+    for key, value in iter_json_request(r, stream_key):
+      if key != stream_key:
+        yield key, value
+        continue
+      num_records += 1
+      if value[id_key] not in seen:
+        seen.add(value[id_key])
+        yield key, value
+    if num_records < page_size:
+      continue
+    # bigpanda treats both ends of the date range as inclusive
+    window_from, window_to = window if window else (date_from, date_to)
+    window_days = (window_to - window_from).days
+    if window_days < 1:
+      OUTPUT.text(f'Results from {url} on {window_from} may be incomplete: more than {page_size} records')
+      continue
+    window_mid = window_from + datetime.timedelta(days = window_days // 2)
+    windows[:0] = [ (window_from, window_mid), (window_mid + datetime.timedelta(days = 1), window_to) ]
+
+
+def iter_cached_records(
+      url: str,
+      params: dict,
+      ttl: typing.Optional[int],
+      records: typing.Callable[[], typing.Iterator[typing.Tuple[typing.Optional[str], typing.Any]]],
+      tag: str = '',
+      refresh: bool = False,
+      chunk_size: int = CACHE_CHUNK_SIZE,
+    ) -> typing.Iterator[typing.Tuple[typing.Optional[str], typing.Any]]:
+  # the records are stored in chunks as they are parsed, and the listing is complete once the number of chunks is
+  # stored under the key, so that neither writing nor reading holds more than a chunk of a listing in memory; if the
+  # source raises, e.g. IncompleteResponse, the number of chunks is never stored and the listing is refetched
+  key = ResponseCache.make_key(url, params, tag)
+  get_chunk_key = lambda chunk_idx: f'{key}@{chunk_idx}'
+  if CACHE and not refresh:
+    index = CACHE.get(key)
+    # a chunk may have been evicted on its own, in which case the whole listing is refetched
+    if isinstance(index, dict) and CACHE.contains([ get_chunk_key(chunk_idx) for chunk_idx in range(index['chunks']) ]):
+      PROFILER.add_cache_hit(Profiler.get_endpoint(url))
+      for chunk_idx in range(index['chunks']):
+        yield from (tuple(record) for record in CACHE.get(get_chunk_key(chunk_idx)) or [])
+      return
+  chunk = []
+  num_chunks = 0
+  for record in records():
+    yield record
+    if not CACHE:
+      continue
+    chunk.append(record)
+    if len(chunk) >= chunk_size:
+      CACHE.put(get_chunk_key(num_chunks), chunk, ttl)
+      chunk = []
+      num_chunks += 1
+  if CACHE and (chunk or num_chunks):
+    if chunk:
+      CACHE.put(get_chunk_key(num_chunks), chunk, ttl)
+      num_chunks += 1
+    CACHE.put(key, { 'chunks' : num_chunks }, ttl)
+
+
+def get_cached_json(
+      url: str,
+      params: dict,
+      ttl: typing.Callable[[dict], typing.Optional[int]],
+      tag: str = '',
+      refresh: bool = False,
+    ) -> dict:
+  key = ResponseCache.make_key(url, params, tag)
+  if CACHE and not refresh:
+    data = CACHE.get(key)
+    if data is not None:
+      PROFILER.add_cache_hit(Profiler.get_endpoint(url))
+      return data
+  r = TRANSPORT.get(url, params = params, headers = JSON_HEADERS)
+  data = get_json_request(r)
+  if CACHE and data:
+    CACHE.put(key, data, ttl(data))
   return data
 
 
-def pbook(name: str, contains: str = '', status: str = '', days: int = 14) -> dict:
-  url = 'https://bigpanda.cern.ch/tasks'
+def pbook(
+      name: str,
+      contains: str = '',
+      status: str = '',
+      days: int = 14,
+      refresh: bool = False,
+      page_size: int = PAGE_SIZE,
+      task_ids: typing.Optional[typing.List[int]] = None,
+    ) -> typing.List[dict]:
+  url = f'{BIGPANDA_URL}/tasks'
   params = {
     'username' : name,
     'days'     : days,
     'json'     : 1,
-    'limit'    : 10000,
     'datasets' : True,
   }
   if contains:
     params['taskname'] = f'*{contains}*'
   if status:
     params['status'] = status
-  r = requests.get(url, params = params, headers = JSON_HEADERS)
-  return get_json_request(r)
-
-
-def get_task(task_id: int) -> dict:
-  url = 'https://bigpanda.cern.ch/jobs'
+  today = datetime.date.today()
+  date_from = today - datetime.timedelta(days = days)
+  date_to = today + datetime.timedelta(days = 1)
+  # selected tasks are looked up one by one rather than picked out of everything the user has in the time window;
+  # the other filters are still applied by bigpanda, hence a task that does not pass them is simply not returned
+  queries = [ dict(params, jeditaskid = task_id) for task_id in dict.fromkeys(task_ids) ] if task_ids else [ params ]
+  tasks = []
+  for query_params in queries:
+    records = iter_cached_records(
+      url, dict(query_params, limit = page_size), CACHE_TTL,
+      lambda: iter_pages(url, query_params, None, 'jeditaskid', date_from, date_to, page_size),
+      refresh = refresh,
+    )
+    # the tasks listed before an error are still shown, the error has been reported already
+    try:
+      for _, task in records:
+        tasks.append(task)
+    except IncompleteResponse:
+      pass
+  return tasks
+
+
+class JobRecord(typing.NamedTuple):
+  # the fields of a /jobs record that are used, everything else is dropped as soon as a job is parsed
+  pandaid: int
+  chain_id: int
+  computingsite: str
+  jobstatus: str
+  taskbuffererrorcode: int
+  creationtime: str
+  endtime: typing.Optional[str]
+  prodsourcelabel: str
+
+  @classmethod
+  def from_job(cls, job_info: dict) -> 'JobRecord':
+    # the retries of a job carry the ID of the job that started the chain in their name; the few distinct sites,
+    # statuses and labels are interned, so that the records share a single copy of each
+    jobid_original_match = JOB_ID_RGX.search(job_info['jobname'])
+    return cls(
+      job_info['pandaid'],
+      int(jobid_original_match.group(1)) if jobid_original_match else job_info['pandaid'],
+      sys.intern(job_info['computingsite']),
+      sys.intern(job_info['jobstatus']),
+      job_info['taskbuffererrorcode'],
+      job_info['creationtime'],
+      job_info['endtime'],
+      sys.intern(job_info['prodsourcelabel']),
+    )
+
+
+def project_task_records(
+      records: typing.Iterator[typing.Tuple[typing.Optional[str], typing.Any]],
+    ) -> typing.Iterator[typing.Tuple[str, typing.Any]]:
+  for key, value in records:
+    if key == 'jobs':
+      yield key, JobRecord.from_job(value)
+    elif key == 'errsByCount':
+      yield key, [ { field : task_err[field] for field in [ 'error', 'diag', 'pandalist' ] } for task_err in value ]
+
+
+def iter_task(
+      task_id: int,
+      task_status: str = '',
+      modification_time: str = '',
+      creation_time: str = '',
+      page_size: int = PAGE_SIZE,
+      refresh: bool = False,
+    ) -> typing.Iterator[typing.Tuple[str, typing.Any]]:
+  url = f'{BIGPANDA_URL}/jobs'
+  # only the user jobs are considered, the other ones are dropped by bigpanda already
   params = {
-    'jeditaskid' : task_id,
-    'mode'       : 'nodrop',
+    'jeditaskid'      : task_id,
+    'mode'            : 'nodrop',
+    'prodsourcelabel' : 'user',
   }
-  r = requests.get(url, params = params, headers = JSON_HEADERS)
-  return get_json_request(r)
+  date_from = datetime.date.fromisoformat(creation_time[:10]) if creation_time else datetime.date.today() - datetime.timedelta(days = 365)
+  date_to = datetime.date.today() + datetime.timedelta(days = 1)
+  # the modification time is part of the cache key so that a retried task does not return stale jobs, and the jobs
+  # are cached in their projected form, which is much smaller than the full records
+  ttl = None if task_status in TASK_FINAL_STATUSES else CACHE_TTL
+  records = iter_cached_records(
+    url, dict(params, limit = page_size), ttl,
+    lambda: project_task_records(iter_pages(url, params, 'jobs', 'pandaid', date_from, date_to, page_size)),
+    f'projected:{modification_time}', refresh,
+  )
+  return ((key, JobRecord(*value) if key == 'jobs' else value) for key, value in records)
 
 
-def get_job(job_id: int) -> dict:
-  url = 'https://bigpanda.cern.ch/job'
+def get_job(job_id: int, refresh: bool = False) -> dict:
+  url = f'{BIGPANDA_URL}/job'
   params = {
     'pandaid' : job_id,
   }
-  r = requests.get(url, params = params, headers = JSON_HEADERS)
-  return get_json_request(r)
+  return get_cached_json(
+    url, params, lambda data: None if data['job']['jobstatus'] in JOB_FINAL_STATUSES else CACHE_TTL, refresh = refresh,
+  )
+
+
+def get_jobs(job_ids: typing.List[int], max_workers: int = 1, refresh: bool = False) -> typing.List[dict]:
+  if max_workers <= 1:
+    return [ get_job(job_id, refresh) for job_id in job_ids ]
+  # the results are returned in the same order as the job IDs regardless of the order in which the requests complete
+  with concurrent.futures.ThreadPoolExecutor(max_workers = max_workers) as executor:
+    return list(executor.map(lambda job_id: get_job(job_id, refresh), job_ids))
 
 
 def values_to_matching_keys(list_of_dicts: typing.List[dict], condition: typing.Callable[[dict], bool]) -> typing.List[str]:
@@ -154,7 +912,7 @@ def get_input_lfns(job_files: typing.List[dict], input_datasets: str) -> typing.
   )
 
 
-def get_args():
+def get_args(argv: typing.Optional[typing.List[str]] = None) -> argparse.Namespace:
   parser = argparse.ArgumentParser(
     formatter_class = argparse.ArgumentDefaultsHelpFormatter,
   )
@@ -185,7 +943,129 @@ def get_args():
     '-t', '--task-id', type = int, default = [], nargs = '+', dest = 'task_id',
     help = 'Task IDs to filter',
   )
-  return parser.parse_args()
+  parser.add_argument(
+    '--bigpanda-url', type = str, default = BIGPANDA_URL, dest = 'bigpanda_url',
+    help = 'Base URL of the bigpanda monitor',
+  )
+  parser.add_argument(
+    '-f', '--show-files', action = 'store_true', default = False, dest = 'show_files',
+    help = 'Fetch the latest job of every job chain to show its input, output and log files',
+  )
+  parser.add_argument(
+    '-j', '--jobs', type = int, default = 8, dest = 'jobs',
+    help = 'Number of job records fetched in parallel with --show-files',
+  )
+  parser.add_argument(
+    '-m', '--max-per-host', type = int, default = MAX_REQUESTS_PER_HOST, dest = 'max_per_host',
+    help = 'Maximum number of concurrent requests sent to the same host',
+  )
+  parser.add_argument(
+    '--timeout', type = float, default = HTTP_TIMEOUT,
+    help = 'Timeout in seconds of a single HTTP request',
+  )
+  parser.add_argument(
+    '--retries', type = int, default = HTTP_RETRIES,
+    help = 'Number of times a failed or throttled HTTP request is retried with exponential backoff',
+  )
+  parser.add_argument(
+    '--rate', type = float, default = HTTP_RATE,
+    help = 'Maximum number of HTTP requests per second (0 for no limit)',
+  )
+  parser.add_argument(
+    '-D', '--no-datasets', action = 'store_true', default = False, dest = 'no_datasets',
+    help = 'Do not list the files and replicas of the task datasets, so that Rucio is never contacted',
+  )
+  parser.add_argument(
+    '--download', type = str, default = '', metavar = 'DIR',
+    help = 'Download the output datasets of the tasks to DIR, skipping the files that are already there and resuming ' \
+           'the partial ones',
+  )
+  parser.add_argument(
+    '--download-workers', type = int, default = DOWNLOAD_WORKERS, dest = 'download_workers',
+    help = 'Number of files downloaded in parallel with --download',
+  )
+  parser.add_argument(
+    '--rse-limit', type = int, default = DOWNLOAD_PER_RSE, dest = 'rse_limit',
+    help = 'Maximum number of files downloaded in parallel from the same RSE',
+  )
+  parser.add_argument(
+    '-b', '--replica-batch-size', type = int, default = REPLICA_BATCH_SIZE, dest = 'replica_batch_size',
+    help = 'Number of files whose replicas are looked up with a single Rucio call',
+  )
+  parser.add_argument(
+    '-p', '--page-size', type = int, default = PAGE_SIZE, dest = 'page_size',
+    help = 'Maximum number of tasks or jobs requested from bigpanda at once',
+  )
+  parser.add_argument(
+    '-n', '--no-cache', action = 'store_true', default = False, dest = 'no_cache',
+    help = f'Do not read or write the response cache at {CACHE_PATH}',
+  )
+  parser.add_argument(
+    '-r', '--refresh', action = 'store_true', default = False,
+    help = 'Ignore cached responses, but store the new ones',
+  )
+  parser.add_argument(
+    '--cache-ttl', type = int, default = CACHE_TTL, dest = 'cache_ttl',
+    help = 'Time in seconds after which cached records that may still change expire',
+  )
+  parser.add_argument(
+    '--replica-ttl', type = int, default = REPLICA_TTL, dest = 'replica_ttl',
+    help = 'Seconds for which dataset contents and replica sites are kept in the response cache',
+  )
+  parser.add_argument(
+    '--cache-size', type = int, default = CACHE_MAX_SIZE, dest = 'cache_size',
+    help = 'Maximum size of the response cache in MB',
+  )
+  parser.add_argument(
+    '-C', '--compact', action = 'store_true', default = False,
+    help = 'Print every job chain on a single line and show the site tables only per task and overall',
+  )
+  parser.add_argument(
+    '--max-chains', type = int, default = 0, dest = 'max_chains', metavar = 'N',
+    help = 'Print at most N job chains per task, the rest count only towards the task statistics (0 for no limit)',
+  )
+  parser.add_argument(
+    '-o', '--output', type = str, default = 'text', choices = OUTPUT_MODES,
+    help = 'Output format; with ndjson, one JSON record per job chain, task and the global site statistics is ' \
+           'streamed to stdout and the text report is printed to stderr',
+  )
+  parser.add_argument(
+    '-P', '--profile', type = str, default = '', nargs = '?', const = '-', metavar = 'FILE',
+    help = 'Report request counts, latencies, transferred bytes, cache hits and the time spent in each phase at exit; ' \
+           'the report is written as JSON if FILE is given',
+  )
+  parser.add_argument(
+    '-B', '--batch', type = str, default = '', metavar = 'FILE',
+    help = f'Run the queries listed in FILE, one per line, in a single process; a query can set the options ' \
+           f'{", ".join("--" + option.replace("_", "-") for option in QUERY_OPTIONS)}',
+  )
+  parser.add_argument(
+    '-H', '--site-history', type = int, default = 0, metavar = 'DAYS', dest = 'site_history',
+    help = f'Report the site reliability of the last DAYS days from the site history at {HISTORY_PATH}, '
+           'fetching only the jobs of the tasks that are not stored yet',
+  )
+  parser.add_argument(
+    '--no-history', action = 'store_true', default = False, dest = 'no_history',
+    help = 'Do not store the finished jobs in the site history',
+  )
+  parser.add_argument(
+    '--serve', action = 'store_true', default = False,
+    help = f'Run as a daemon that answers queries over HTTP on the Unix socket given by --daemon-socket, '
+           f'rerunning them in the background every --watch seconds (default: {DAEMON_REFRESH})',
+  )
+  parser.add_argument(
+    '--daemon-socket', type = str, default = DAEMON_SOCKET, dest = 'daemon_socket', metavar = 'PATH',
+    help = 'Unix socket of the daemon, which is used for the query when it is running',
+  )
+  parser.add_argument(
+    '--no-daemon', action = 'store_true', default = False, dest = 'no_daemon',
+    help = 'Run the query locally even if a daemon is running',
+  )
+  parser.add_argument(
+    '-w', '--watch', type = int, default = 0, metavar = 'SECONDS',
+    help = 'Rerun every SECONDS seconds and report only the tasks that have changed (0 to run once)',
+  )
+  return parser.parse_args(argv)
 
 
 def int_to_si(n: int) -> str:
@@ -199,27 +1079,19 @@ def int_to_si(n: int) -> str:
   return f'{n:.0f}{sfxs[idx]}'
 
 
-def date_to_unix(date: str) -> int:
-  return int(datetime.datetime.strptime(date, '%Y-%m-%dT%H:%M:%S').timestamp())
-
-
-def find_job_from_task(list_of_jobs: dict, job_id: int):
-  for job_info in list_of_jobs:
-    if job_info['pandaid'] == job_id:
-      return job_info
-  return {}
-
-
-def get_start_time(list_of_jobs: dict, job_id: int) -> int:
-  job_info = find_job_from_task(list_of_jobs, job_id)
-  assert(job_info)
-  return date_to_unix(job_info['creationtime'])
-
-
-def get_end_time(list_of_jobs: dict, job_id: int) -> int:
-  job_info = find_job_from_task(list_of_jobs, job_id)
-  assert(job_info)
-  return date_to_unix(job_info['endtime']) if job_info['endtime'] else int(time.time())
+def index_errors(task_errs: typing.List[dict]) -> dict:
+  job_errs = {}
+  for task_err in task_errs:
+    pandalist = task_err['pandalist']
+    if isinstance(pandalist, str):
+      pandalist = re.findall(r'\d+', pandalist)
+    for jobid in set(int(jobid) for jobid in pandalist):
+      if jobid not in job_errs:
+        job_errs[jobid] = []
+      # the same error can be reported more than once if the jobs were fetched in several pages
+      if task_err['error'] not in job_errs[jobid]:
+        job_errs[jobid].append(task_err['error'])
+  return job_errs
 
 
 def pluralize(word: str, count: int):
@@ -245,15 +1117,234 @@ def seconds_to_human_readable(seconds: int) -> str:
   return ', '.join(parts)
 
 
-def print_stats(site_stats: dict, site_attempts: dict, error_messages: dict, indentation: int = 0) -> None:
-  site_stats_sorted = list(sorted(site_stats.items(), key = lambda kv: sum(kw[1] for kw in kv[1].items()), reverse = True))
+class SiteStats:
+  __slots__ = ('errors', 'attempts')
+
+  def __init__(self):
+    self.errors = {}
+    self.attempts = {}
+
+  def add_site(self, site: str) -> None:
+    if site not in self.errors:
+      self.errors[site] = collections.Counter()
+      self.attempts[site] = 0
+
+  def add_attempt(self, site: str, errs: typing.List[str]) -> None:
+    self.add_site(site)
+    site_errors = self.errors[site]
+    for err in errs:
+      site_errors[err] += 1
+    if not errs:
+      site_errors[PANDA_NO_ERROR] += 1
+    self.attempts[site] += 1
+
+  def update(self, other: 'SiteStats') -> None:
+    for site, site_errors in other.errors.items():
+      self.add_site(site)
+      self.errors[site].update(site_errors)
+      self.attempts[site] += other.attempts[site]
+
+  def total_attempts(self) -> int:
+    return sum(self.attempts.values())
+
+  def to_dict(self) -> dict:
+    return {
+      site : { 'attempts' : self.attempts[site], 'errors' : dict(site_errors) }
+      for site, site_errors in self.errors.items()
+    }
+
+
+class JobTable:
+  # the jobs of a task are held column-wise, so that chains, times and site statistics are computed with array operations
+  # rather than with per-job dictionaries; job chains are grouped by the original job ID that is encoded in the job name
+  def __init__(self, columns: dict, job_errs: dict, is_complete: bool = True):
+    # an incomplete table holds what was listed before the job listing broke off
+    self.is_complete = is_complete
+    self.ids = np.array(columns['pandaid'], dtype = np.int64)
+    site_codes = {}
+    self.sites = np.array(
+      [ site_codes.setdefault(site, len(site_codes)) for site in columns['computingsite'] ], dtype = np.int64,
+    )
+    self.site_names = list(site_codes)
+    self.statuses = columns['jobstatus']
+    self.is_retasked = np.array(columns['taskbuffererrorcode'], dtype = np.int64) != 0 # reassigned by jedi or killed by panda
+    self.is_done = np.isin(np.array(self.statuses, dtype = object), JOB_FINAL_STATUSES)
+    # the timestamps are in UTC, jobs that have not ended yet are considered to end now
+    self.start = np.array(columns['creationtime'], dtype = 'datetime64[s]').astype(np.int64)
+    end = np.array([ t or None for t in columns['endtime'] ], dtype = 'datetime64[s]')
+    self.end = np.where(np.isnat(end), int(time.time()), end.astype(np.int64))
+
+    self.job_errs = job_errs
+    # the errors are flattened into (row, code, position in the job's error list) entries
+    err_codes = { PANDA_NO_ERROR : 0 }
+    rows_by_id = { job_id : row for row, job_id in enumerate(columns['pandaid']) }
+    err_rows, err_row_codes, err_order = [], [], []
+    for job_id, errs in job_errs.items():
+      row = rows_by_id.get(job_id)
+      if row is None:
+        continue
+      for err_idx, err in enumerate(errs):
+        err_rows.append(row)
+        err_row_codes.append(err_codes.setdefault(err, len(err_codes)))
+        err_order.append(err_idx)
+    self.err_names = list(err_codes)
+    self.err_rows = np.array(err_rows, dtype = np.int64)
+    self.err_codes = np.array(err_row_codes, dtype = np.int64)
+    self.err_order = np.array(err_order, dtype = np.int64)
+    self.num_errs = np.bincount(self.err_rows, minlength = len(self.ids))
+    # the error codes grouped by job, so that the errors of any set of jobs are sliced out without a whole-table mask
+    self.err_offsets = np.concatenate(([ 0 ], np.cumsum(self.num_errs)))
+    self.err_codes_by_row = self.err_codes[np.lexsort((self.err_order, self.err_rows))]
+
+    chain_ids = np.array(columns['chain_id'], dtype = np.int64)
+    _, first_rows, chain_idxs = np.unique(chain_ids, return_index = True, return_inverse = True)
+    chain_ranks = np.argsort(np.argsort(first_rows))[chain_idxs.ravel()] # chains are kept in the order they were listed
+    order = np.lexsort((self.ids, chain_ranks))
+    chain_sizes = np.bincount(chain_ranks, minlength = len(first_rows))
+    self.chain_offsets = np.concatenate(([ 0 ], np.cumsum(chain_sizes)))
+    self.chain_rows = order
+    self.chain_start = self.start[order[self.chain_offsets[:-1]]]
+    self.chain_end = self.end[order[self.chain_offsets[1:] - 1]]
+
+  def __len__(self) -> int:
+    return len(self.ids)
+
+  def num_chains(self) -> int:
+    return len(self.chain_offsets) - 1
+
+  def chain(self, chain_idx: int) -> np.ndarray:
+    return self.chain_rows[self.chain_offsets[chain_idx]:self.chain_offsets[chain_idx + 1]]
+
+  def job(self, row: int) -> dict:
+    job_id = int(self.ids[row])
+    return {
+      'id'          : job_id,
+      'site'        : self.site_names[self.sites[row]],
+      'errs'        : self.job_errs.get(job_id, []),
+      'is_retasked' : bool(self.is_retasked[row]),
+      'is_done'     : bool(self.is_done[row]),
+    }
+
+  def site_stats(self, rows: np.ndarray) -> SiteStats:
+    return self.grouped_site_stats(rows, np.zeros(len(rows), dtype = np.int64), 1)[0]
+
+  def chain_site_stats(self, num_chains: int) -> typing.List[SiteStats]:
+    # the statistics of the first num_chains chains are computed in a single pass rather than with a call per chain
+    row_chains = np.repeat(np.arange(num_chains), np.diff(self.chain_offsets[:num_chains + 1]))
+    return self.grouped_site_stats(self.chain_rows[:self.chain_offsets[num_chains]], row_chains, num_chains)
+
+  def grouped_site_stats(self, rows: np.ndarray, row_groups: np.ndarray, num_groups: int) -> typing.List[SiteStats]:
+    # the sites and their errors are inserted in the order in which they first appear in the rows of a group, which
+    # keeps the order of the rows with equal counts in the tables the same as when the jobs are counted one by one
+    groups_stats = [ SiteStats() for _ in range(num_groups) ]
+    num_sites = len(self.site_names)
+    num_err_names = len(self.err_names)
+    group_sites, first_rows = np.unique(row_groups * num_sites + self.sites[rows], return_index = True)
+    for group_site in group_sites[np.argsort(first_rows)].tolist():
+      group, site = divmod(group_site, num_sites)
+      groups_stats[group].add_site(self.site_names[site])
+
+    # every counted job contributes its errors in their order, or a single entry without error; the errors are sliced
+    # out per job, so that all the arrays are only as large as the given rows
+    is_counted = self.is_done[rows] & ~self.is_retasked[rows]
+    counted = rows[is_counted]
+    counted_groups = row_groups[is_counted]
+    num_errs = self.num_errs[counted]
+    num_entries = np.maximum(num_errs, 1)
+    entry_rows = np.repeat(counted, num_entries)
+    entry_idxs = np.arange(len(entry_rows)) - np.repeat(np.cumsum(num_entries) - num_entries, num_entries)
+    has_err = np.repeat(num_errs > 0, num_entries)
+    entry_codes = np.zeros(len(entry_rows), dtype = np.int64)
+    entry_codes[has_err] = self.err_codes_by_row[self.err_offsets[entry_rows[has_err]] + entry_idxs[has_err]]
+
+    entry_group_sites = np.repeat(counted_groups, num_entries) * num_sites + self.sites[entry_rows]
+    triples, first_entries, triple_counts = np.unique(
+      entry_group_sites * num_err_names + entry_codes, return_index = True, return_counts = True,
+    )
+    triple_order = np.argsort(first_entries)
+    for triple, triple_count in zip(triples[triple_order].tolist(), triple_counts[triple_order].tolist()):
+      group_site, err = divmod(triple, num_err_names)
+      group, site = divmod(group_site, num_sites)
+      groups_stats[group].errors[self.site_names[site]][self.err_names[err]] += triple_count
+    attempts = np.bincount(counted_groups * num_sites + self.sites[counted], minlength = num_groups * num_sites)
+    for group_site in np.flatnonzero(attempts).tolist():
+      group, site = divmod(group_site, num_sites)
+      groups_stats[group].attempts[self.site_names[site]] += int(attempts[group_site])
+    return groups_stats
+
+
+class SiteHistory:
+  def __init__(self, path: str):
+    os.makedirs(os.path.dirname(path), exist_ok = True)
+    self.lock = threading.Lock()
+    self.db = sqlite3.connect(path, check_same_thread = False)
+    self.db.execute('PRAGMA journal_mode = WAL')
+    self.db.execute('PRAGMA synchronous = NORMAL')
+    self.db.execute(
+      'CREATE TABLE IF NOT EXISTS jobs ('
+      'pandaid INTEGER PRIMARY KEY, task_id INTEGER, site TEXT, errors TEXT, is_retasked INTEGER, start REAL, end REAL)'
+    )
+    self.db.execute('CREATE INDEX IF NOT EXISTS jobs_by_end ON jobs (end)')
+    # tasks in a final state whose jobs have all been stored, keyed by the modification time seen at that point
+    self.db.execute('CREATE TABLE IF NOT EXISTS tasks (task_id INTEGER PRIMARY KEY, modified TEXT)')
+    self.db.execute('CREATE TABLE IF NOT EXISTS error_messages (code TEXT PRIMARY KEY, message TEXT)')
+
+  def is_ingested(self, task_id: int, modified: str) -> bool:
+    with self.lock:
+      row = self.db.execute('SELECT modified FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+    return row is not None and row[0] == modified
+
+  def ingest(
+        self,
+        task_id: int,
+        jobs: typing.List[tuple],
+        error_messages: dict,
+        modified: typing.Optional[str] = None,
+      ) -> None:
+    with self.lock:
+      self.db.executemany(
+        'INSERT OR REPLACE INTO jobs (pandaid, task_id, site, errors, is_retasked, start, end) VALUES (?, ?, ?, ?, ?, ?, ?)',
+        [ (job_id, task_id, site, json.dumps(errs), int(is_retasked), start, end) for job_id, site, errs, is_retasked, start, end in jobs ],
+      )
+      self.db.executemany('INSERT OR REPLACE INTO error_messages (code, message) VALUES (?, ?)', error_messages.items())
+      if modified is not None:
+        self.db.execute('INSERT OR REPLACE INTO tasks (task_id, modified) VALUES (?, ?)', (task_id, modified))
+      self.db.commit()
+
+  def get_site_stats(self, task_ids: typing.List[int], since: float) -> SiteStats:
+    site_stats = SiteStats()
+    with self.lock:
+      for batch_start in range(0, len(task_ids), 500):
+        batch = task_ids[batch_start:batch_start + 500]
+        rows = self.db.execute(
+          f'SELECT site, errors, is_retasked FROM jobs WHERE end >= ? AND task_id IN ({",".join("?" * len(batch))})',
+          (since, *batch),
+        )
+        for site, errs, is_retasked in rows:
+          site_stats.add_site(site)
+          if not is_retasked:
+            site_stats.add_attempt(site, json.loads(errs))
+    return site_stats
+
+  def get_error_messages(self) -> dict:
+    with self.lock:
+      return dict(self.db.execute('SELECT code, message FROM error_messages'))
+
+  def close(self) -> None:
+    with self.lock:
+      self.db.commit()
+      self.db.close()
+
+
+def print_stats(site_stats: SiteStats, error_messages: dict, indentation: int = 0) -> None:
+  site_stats_sorted = list(sorted(site_stats.errors.items(), key = lambda kv: sum(kv[1].values()), reverse = True))
   table_data = [ [ 'Site', 'Errors', 'Description', 'Attempts', 'Success rate [%]' ] ]
   for site_name, site_errors in site_stats_sorted:
-    attempts = site_attempts[site_name]
+    attempts = site_stats.attempts[site_name]
     if not attempts:
       continue
 
-    successes = 0 if PANDA_NO_ERROR not in site_errors else site_errors[PANDA_NO_ERROR]
+    successes = site_errors[PANDA_NO_ERROR]
     site_errors_sorted = list(sorted(site_errors.items(), key = lambda kv: kv[1], reverse = True))
 
     rows = []
@@ -275,33 +1366,11 @@ def print_stats(site_stats: dict, site_attempts: dict, error_messages: dict, ind
         '' if err_idx else f'{successes / attempts * 100:.0f}%',
       ])
     table_data.extend(rows)
-  table = tabulate.tabulate(table_data, headers = 'firstrow', tablefmt = 'rounded_outline')
-  indented_table = '\n'.join(' ' * indentation + line for line in table.splitlines())
-  print(indented_table)
-
-
-def merge_stats(first: dict, second: dict) -> dict:
-  new = copy.deepcopy(first)
-  for site_name, site_data in second.items():
-    if site_name not in new:
-      new[site_name] = site_data
-    else:
-      for site_error, error_count in site_data.items():
-        if site_error not in new[site_name]:
-          new[site_name][site_error] = error_count
-        else:
-          new[site_name][site_error] += error_count
-  return new
-
-
-def merge_attempts(first: dict, second: dict) -> dict:
-  new = copy.deepcopy(first)
-  for site_name, nof_attempts in second.items():
-    if site_name in new:
-      new[site_name] += nof_attempts
-    else:
-      new[site_name] = nof_attempts
-  return new
+  with PROFILER.phase('rendering'):
+    table = tabulate.tabulate(table_data, headers = 'firstrow', tablefmt = 'rounded_outline')
+    space = ' ' * indentation
+    for line in table.splitlines():
+      OUTPUT.text(f'{space}{line}')
 
 
 def get_job_id_str(job_info: dict) -> str:
@@ -320,34 +1389,150 @@ def extract_scope_and_name(dataset: str) -> dict:
   raise RuntimeError(f'Unable to extract scope and name from: {dataset}')
 
 
-def list_replica_sites(client: Client, scope: str, name: str) -> dict:
-  gen = client.list_replicas([ { 'scope' : scope, 'name' : name } ])
-  replica = None
-  for tmp in gen:
-    assert(not replica)
-    replica = tmp
-  return list(sorted([ k for k, v in replica['states'].items() if v == 'AVAILABLE' ]))
+def get_replica_key(did_key: typing.Tuple[str, str]) -> str:
+  return f'rucio:replicas#{did_key[0]}:{did_key[1]}'
+
+
+def get_memoised(memo: collections.OrderedDict, key: typing.Any) -> typing.Optional[typing.Any]:
+  # must be called with DATASET_INFO_LOCK held
+  entry = memo.get(key)
+  if entry is None:
+    return None
+  if time.time() - entry[0] > REPLICA_TTL:
+    del memo[key]
+    return None
+  memo.move_to_end(key)
+  return entry[1]
+
+
+def memoise(memo: collections.OrderedDict, items: dict, max_size: int) -> None:
+  # must be called with DATASET_INFO_LOCK held; the least recently used entries are dropped beyond max_size
+  now = time.time()
+  for key, value in items.items():
+    memo[key] = (now, value)
+    memo.move_to_end(key)
+  while len(memo) > max_size:
+    memo.popitem(last = False)
+
+
+def list_replica_sites(client: 'Client', dids: typing.List[dict], batch_size: int = REPLICA_BATCH_SIZE) -> dict:
+  # the same files show up in many tasks of a campaign, so their replica sites are memoised in memory for the run and
+  # persisted in the response cache across runs; only the files found in neither are resolved with Rucio
+  replica_sites = {}
+  with DATASET_INFO_LOCK:
+    for did in dids:
+      did_key = (did['scope'], did['name'])
+      sites = get_memoised(REPLICA_SITES, did_key)
+      if sites is not None:
+        replica_sites[did_key] = sites
+  missing = [ (did['scope'], did['name']) for did in dids if (did['scope'], did['name']) not in replica_sites ]
+  found = {}
+  if CACHE and missing:
+    cached = CACHE.get_many([ get_replica_key(did_key) for did_key in missing ])
+    for did_key in missing:
+      sites = cached.get(get_replica_key(did_key))
+      if sites is not None:
+        found[did_key] = sites
+    if cached:
+      PROFILER.add_cache_hit('rucio:list_replicas')
+    missing = [ did_key for did_key in missing if did_key not in found ]
+
+  resolved = {}
+  for batch_start in range(0, len(missing), batch_size):
+    batch = [ { 'scope' : scope, 'name' : name } for scope, name in missing[batch_start:batch_start + batch_size] ]
+    with PROFILER.call('rucio:list_replicas'):
+      for replica in client.list_replicas(batch):
+        did_key = (replica['scope'], replica['name'])
+        assert(did_key not in resolved)
+        resolved[did_key] = list(sorted([ k for k, v in replica['states'].items() if v == 'AVAILABLE' ]))
+  if CACHE and resolved:
+    CACHE.put_many({ get_replica_key(did_key) : sites for did_key, sites in resolved.items() }, REPLICA_TTL)
+  found.update(resolved)
+  replica_sites.update(found)
+
+  # only the newly found entries are memoised, so that the memoised ones still expire
+  with DATASET_INFO_LOCK:
+    memoise(REPLICA_SITES, found, REPLICA_MEMO_SIZE)
+  return replica_sites
+
+
+def list_dataset_files(client: 'Client', dataset: str) -> typing.List[dict]:
+  with DATASET_INFO_LOCK:
+    files = get_memoised(DATASET_FILES, dataset)
+  if files is not None:
+    return files
+  # the tag changes whenever fields are added to the projection, so that older lists are not read back without them
+  key = f'rucio:files#{dataset}#projected:checksums'
+  files = CACHE.get(key) if CACHE else None
+  if files is not None:
+    PROFILER.add_cache_hit('rucio:list_files')
+  else:
+    scope_name = extract_scope_and_name(dataset)
+    with PROFILER.call('rucio:list_files'):
+      files = [
+        { 'scope' : f['scope'], 'name' : f['name'], 'events' : f['events'], 'bytes' : f.get('bytes'), 'adler32' : f.get('adler32') }
+        for f in client.list_files(**scope_name)
+      ]
+    if CACHE:
+      CACHE.put(key, files, REPLICA_TTL)
+  with DATASET_INFO_LOCK:
+    memoise(DATASET_FILES, { dataset : files }, DATASET_MEMO_SIZE)
+  return files
+
+
+def get_dataset_info(client: 'Client', dataset: str, batch_size: int = REPLICA_BATCH_SIZE) -> dict:
+  files = list_dataset_files(client, dataset)
+  replica_sites = list_replica_sites(client, files, batch_size)
+  return {
+    f['name'] : { 'nevents' : f['events'], 'sites' : replica_sites.get((f['scope'], f['name']), []) } for f in files
+  }
 
 
-def print_dataset_info(client: Client, dataset: str, indent: int = 0) -> dict:
-  scope_name = extract_scope_and_name(dataset)
-  gen = client.list_files(**scope_name)
+def print_dataset_info(client: 'Client', dataset: str, indent: int = 0, batch_size: int = REPLICA_BATCH_SIZE) -> dict:
   space = ' ' * indent
-  dataset_info = { dataset : {} }
-  for f in gen:
-    sites = list_replica_sites(client, f['scope'], f['name'])
-    dataset_info[dataset][f['name']] = { 'nevents' : f['events'], 'sites' : sites }
-
-    dataset_str = f'{space}{f["name"]}: '
-    if f['events'] is not None:
-      dataset_str += f'{f["events"]} events, '
+  dataset_info = { dataset : get_dataset_info(client, dataset, batch_size) }
+  for file_name, file_info in dataset_info[dataset].items():
+    sites = file_info['sites']
+    dataset_str = f'{space}{file_name}: '
+    if file_info['nevents'] is not None:
+      dataset_str += f'{file_info["nevents"]} events, '
     num_sites = len(sites)
     dataset_str += f'{num_sites} {pluralize("site", num_sites)} ({", ".join(sites)})'
-    print(dataset_str)
+    OUTPUT.text(dataset_str)
 
   return dataset_info
 
 
+def print_profile(report: dict) -> None:
+  wall_time = report['wall_time']
+  table_data = [ [ 'Endpoint', 'Calls', 'Cache hits', 'p50 [ms]', 'p95 [ms]', 'Max [ms]', 'Total [s]', 'Transferred' ] ]
+  for endpoint, stats in sorted(report['endpoints'].items(), key = lambda kv: kv[1]['total'], reverse = True):
+    table_data.append([
+      endpoint,
+      stats['calls'],
+      stats['cache_hits'],
+      f'{stats["p50"] * 1000:.0f}',
+      f'{stats["p95"] * 1000:.0f}',
+      f'{stats["max"] * 1000:.0f}',
+      f'{stats["total"]:.1f}',
+      f'{int_to_si(stats["bytes"])}B',
+    ])
+  OUTPUT.text(tabulate.tabulate(table_data, headers = 'firstrow', tablefmt = 'rounded_outline'))
+
+  table_data = [ [ 'Phase', 'Time [s]', 'Share [%]' ] ]
+  for phase, elapsed in sorted(report['phases'].items(), key = lambda kv: kv[1], reverse = True):
+    table_data.append([ phase, f'{elapsed:.1f}', f'{elapsed / wall_time * 100:.0f}%' if wall_time else 'n/a' ])
+  table_data.append([ boldify('total'), f'{wall_time:.1f}', '' ])
+  OUTPUT.text(tabulate.tabulate(table_data, headers = 'firstrow', tablefmt = 'rounded_outline'))
+
+  # the background phases run alongside the ones above, so a share of the wall time would not add up
+  if report['background_phases']:
+    table_data = [ [ 'Background phase', 'Time [s]' ] ]
+    for phase, elapsed in sorted(report['background_phases'].items(), key = lambda kv: kv[1], reverse = True):
+      table_data.append([ phase, f'{elapsed:.1f}' ])
+    OUTPUT.text(tabulate.tabulate(table_data, headers = 'firstrow', tablefmt = 'rounded_outline'))
+
+
 def print_summary(tasks_summary: dict):
   table_data = [ [ 'Task ID', 'Datasets', 'Attempts', 'Files', 'Events', 'Completed [%]', 'Status' ] ]
   datasets_to_copy = []
@@ -372,229 +1557,1019 @@ def print_summary(tasks_summary: dict):
     datasets_to_copy.extend(task_data['datasets_out'])
     table_data.extend(rows)
 
-  table = tabulate.tabulate(table_data, headers = 'firstrow', tablefmt = 'rounded_outline', stralign = 'left')
-  print(table)
+  with PROFILER.phase('rendering'):
+    table = tabulate.tabulate(table_data, headers = 'firstrow', tablefmt = 'rounded_outline', stralign = 'left')
+    OUTPUT.text(table)
 
   if datasets_to_copy:
-    print(f'\nTo download all {len(datasets_to_copy)} datasets with rucio, use the following command:\n')
-    print('  rucio download \\')
+    OUTPUT.text(f'\nTo download all {len(datasets_to_copy)} datasets with rucio, use the following command:\n')
+    OUTPUT.text('  rucio download \\')
     for dataset_idx, dataset_name in enumerate(datasets_to_copy):
       str_to_print = dataset_name
       if dataset_idx < len(datasets_to_copy) - 1:
         str_to_print += ' \\'
-      print(f'    {str_to_print}')
-
-
-if __name__ == '__main__':
-  args = get_args()
+      OUTPUT.text(f'    {str_to_print}')
 
-  statuses_include = STATUSES if not args.status_include else args.status_include
-  statuses_exclude = args.status_exclude
-  statuses_keep = ','.join(set(statuses_include) - set(statuses_exclude))
-
-  rucio_client = Client()
 
-  name = args.user if args.user else get_CRIC_name()
-  tasks = pbook(name, contains = args.contains, status = statuses_keep, days = args.days)
-  num_tasks = len(tasks)
-  print(boldify(f'Found {num_tasks} {pluralize("task", num_tasks)}'))
-
-  error_messages = {}
-  all_site_stats = {}
-  all_site_attempts = {}
+def get_x509_kwargs() -> dict:
+  # the grid storage endpoints authenticate with the same proxy as CRIC, but only if there is one
+  capath = os.getenv('X509_CERT_DIR')
+  cert = os.getenv('X509_USER_PROXY')
+  kwargs = {}
+  if capath:
+    kwargs['verify'] = capath
+  if cert:
+    kwargs['cert'] = (cert, cert)
+  return kwargs
+
+
+def list_replica_urls(client: 'Client', dids: typing.List[dict], batch_size: int = REPLICA_BATCH_SIZE) -> dict:
+  # maps every file to the URL of its replica on each RSE that offers one over HTTP
+  replica_urls = {}
+  for batch_start in range(0, len(dids), batch_size):
+    batch = [ { 'scope' : did['scope'], 'name' : did['name'] } for did in dids[batch_start:batch_start + batch_size] ]
+    with PROFILER.call('rucio:list_replicas'):
+      for replica in client.list_replicas(batch, schemes = DOWNLOAD_SCHEMES):
+        replica_urls[(replica['scope'], replica['name'])] = {
+          rse : re.sub(r'^davs://', 'https://', pfns[0]) for rse, pfns in replica.get('rses', {}).items() if pfns
+        }
+  return replica_urls
+
+
+def get_adler32(path: str, checksum: int = 1) -> int:
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+      checksum = zlib.adler32(chunk, checksum)
+  return checksum
+
+
+def is_file_verified(file_info: dict, size: int, checksum: typing.Optional[int]) -> bool:
+  # files without a checksum in Rucio can only be checked for their size
+  if file_info.get('adler32') and checksum is not None:
+    return f'{checksum:08x}' == file_info['adler32'].lower().zfill(8)
+  return file_info.get('bytes') is None or size == file_info['bytes']
+
+
+class ReplicaSlots:
+  def __init__(self, per_rse: int = DOWNLOAD_PER_RSE):
+    # caps the number of concurrent downloads per RSE, so that the download workers spread over the replicas
+    self.per_rse = per_rse
+    self.active = collections.Counter()
+    self.condition = threading.Condition()
+
+  @contextlib.contextmanager
+  def acquire(self, rses: typing.List[str]) -> typing.Iterator[str]:
+    # picks the least busy of the given RSEs and waits if all of them are at the cap
+    with self.condition:
+      while True:
+        free_rses = [ rse for rse in rses if self.active[rse] < self.per_rse ]
+        if free_rses:
+          break
+        self.condition.wait()
+      rse = min(free_rses, key = lambda rse: self.active[rse])
+      self.active[rse] += 1
+    try:
+      yield rse
+    finally:
+      with self.condition:
+        self.active[rse] -= 1
+        self.condition.notify_all()
+
+
+def fetch_replica(url: str, rse: str, part_path: str, file_info: dict) -> typing.Tuple[int, int]:
+  # continues the partial download if there is one and returns the number of bytes fetched and the checksum of the file
+  offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+  file_size = file_info.get('bytes')
+  if file_size is not None and offset > file_size:
+    offset = 0
+  if file_size is not None and offset == file_size:
+    return 0, get_adler32(part_path)
+  headers = { 'Range' : f'bytes={offset}-' } if offset else {}
+  endpoint = f'download:{rse}'
+  r = TRANSPORT.get(url, endpoint = endpoint, headers = headers, stream = True, **get_x509_kwargs())
+  num_bytes = 0
+  try:
+    r.raise_for_status()
+    # a server that does not support ranges sends the whole file
+    if r.status_code != 206:
+      offset = 0
+    checksum = get_adler32(part_path) if offset else 1
+    with open(part_path, 'ab' if offset else 'wb') as f:
+      for chunk in r.iter_content(DOWNLOAD_CHUNK_SIZE):
+        f.write(chunk)
+        checksum = zlib.adler32(chunk, checksum)
+        num_bytes += len(chunk)
+  finally:
+    r.close()
+    PROFILER.add_bytes(endpoint, num_bytes)
+  return num_bytes, checksum
+
+
+def download_file(file_info: dict, replica_urls: dict, target_dir: str, slots: ReplicaSlots) -> dict:
+  path = os.path.join(target_dir, file_info['scope'], file_info['name'])
+  if os.path.exists(path):
+    checksum = get_adler32(path) if file_info.get('adler32') else None
+    if is_file_verified(file_info, os.path.getsize(path), checksum):
+      return { 'status' : 'present', 'bytes' : 0 }
+  os.makedirs(os.path.dirname(path), exist_ok = True)
+
+  # the partial file is kept if a download breaks off, so that it is resumed from the next replica or by the next run
+  part_path = path + '.part'
+  errors = []
+  rses = list(replica_urls)
+  num_bytes = 0
+  while rses:
+    with slots.acquire(rses) as rse:
+      rses.remove(rse)
+      try:
+        fetched, checksum = fetch_replica(replica_urls[rse], rse, part_path, file_info)
+      except (requests.RequestException, OSError) as e:
+        errors.append(f'{rse}: {e}')
+        continue
+    num_bytes += fetched
+    if is_file_verified(file_info, os.path.getsize(part_path), checksum):
+      os.replace(part_path, path)
+      return { 'status' : 'downloaded', 'bytes' : num_bytes, 'rse' : rse }
+    os.remove(part_path)
+    errors.append(f'{rse}: checksum mismatch')
+  if not replica_urls:
+    errors.append('no available replica that can be downloaded over HTTP')
+  return { 'status' : 'failed', 'bytes' : num_bytes, 'errors' : errors }
+
+
+def download_datasets(client: 'Client', datasets: typing.List[str], args: argparse.Namespace) -> None:
+  # the files are downloaded to DIR/<scope>/<name>, like rucio download does
+  datasets = list(dict.fromkeys(datasets))
+  files = {}
+  for dataset in datasets:
+    for file_info in list_dataset_files(client, dataset):
+      files.setdefault((file_info['scope'], file_info['name']), file_info)
+  files = list(files.values())
+  num_files = len(files)
+  OUTPUT.text(boldify(f'\nDownloading {num_files} {pluralize("file", num_files)} of {len(datasets)} {pluralize("dataset", len(datasets))} to {args.download}'))
+  if not files:
+    return
+
+  with PROFILER.phase('download'):
+    start = time.perf_counter()
+    # only the replicas on the sites that Rucio reports as AVAILABLE are tried
+    replica_sites = list_replica_sites(client, files, args.replica_batch_size)
+    replica_urls = list_replica_urls(client, files, args.replica_batch_size)
+    slots = ReplicaSlots(args.rse_limit)
+    counts = collections.Counter()
+    num_bytes = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers = args.download_workers) as executor:
+      futures = {}
+      for file_info in files:
+        did_key = (file_info['scope'], file_info['name'])
+        urls = replica_urls.get(did_key, {})
+        available_urls = { rse : urls[rse] for rse in replica_sites.get(did_key, []) if rse in urls }
+        futures[executor.submit(download_file, file_info, available_urls, args.download, slots)] = file_info
+      for future in concurrent.futures.as_completed(futures):
+        file_info = futures[future]
+        result = future.result()
+        counts[result['status']] += 1
+        num_bytes += result['bytes']
+        file_str = f'{file_info["scope"]}:{file_info["name"]}'
+        if result['status'] == 'downloaded':
+          OUTPUT.text(f'  {file_str}: {int_to_si(result["bytes"])}B from {result["rse"]}')
+        elif result['status'] == 'failed':
+          OUTPUT.text(f'  {file_str}: {colorize("failed")} ({"; ".join(result["errors"])})')
+    elapsed = time.perf_counter() - start
+
+  OUTPUT.text(
+    f'{counts["downloaded"]} downloaded, {counts["present"]} already present, {counts["failed"]} failed; '
+    f'{int_to_si(num_bytes)}B in {elapsed:.1f} s ({int_to_si(int(num_bytes / elapsed) if elapsed else 0)}B/s)'
+  )
 
-  tasks_summary = {}
 
-  for task_idx, task in enumerate(tasks):
-    task_id = task['jeditaskid']
-    if args.task_id and task_id not in args.task_id:
-      continue
+def get_task_datasets(task: dict) -> typing.Tuple[typing.List[str], typing.List[str]]:
+  datasets_in = []
+  datasets_out = []
+  for task_dataset in task['datasets']:
+    if task_dataset['streamname'].startswith('IN'):
+      datasets_in.append(task_dataset['datasetname'])
+    elif task_dataset['streamname'] == 'OUTPUT0' and task_dataset['nfiles'] > 0:
+      datasets_out.append(task_dataset['datasetname'])
+  return datasets_in, datasets_out
+
+
+def get_task_signature(task: dict) -> tuple:
+  # used to decide whether the task has changed since it was last processed
+  dsinfo = task.get('dsinfo') or {}
+  return (
+    task['status'],
+    task.get('modificationtime', ''),
+    dsinfo.get('nfiles'),
+    dsinfo.get('nfilesfinished'),
+    dsinfo.get('nfilesfailed'),
+    dsinfo.get('neventsUsedTot'),
+  )
 
-    task_datasets = task['datasets']
-    datasets_in = []
-    datasets_out = []
-    for task_dataset in task_datasets:
-      if task_dataset['streamname'].startswith('IN'):
-        datasets_in.append(task_dataset['datasetname'])
-      elif task_dataset['streamname'] == 'OUTPUT0' and task_dataset['nfiles'] > 0:
-        datasets_out.append(task_dataset['datasetname'])
-
-    dataset_in_info = {}
-    dataset_out_info = {}
-    print(f'{boldify("TASK")} {task_id}:')
-    print(f'  {boldify("IN")}:     {datasets_in[0] if datasets_in else "n/a"}')
-    if datasets_in:
-      dataset_in_info.update(print_dataset_info(rucio_client, datasets_in[0], 12))
-    if len(datasets_in) > 1:
-      for dataset_in in datasets_in[1:]:
-        print(f'          {dataset_in}')
-        dataset_in_info.update(print_dataset_info(rucio_client, dataset_in, 12))
-    print(f'  {boldify("OUT")}:    {datasets_out[0] if datasets_out else "n/a"}')
-    if datasets_out:
-      dataset_out_info.update(print_dataset_info(rucio_client, datasets_out[0], 12))
-    if len(datasets_out) > 1:
-      for dataset_out in datasets_out[1:]:
-        print(f'          {dataset_out}')
-        dataset_out_info.update(print_dataset_info(rucio_client, dataset_out, 12))
-
-    task_status = task['status']
-    tasks_summary[task_id] = {
-      'datasets_in'    : datasets_in,
-      'datasets_out'   : datasets_out,
-      'total_attempts' : 0,
-      'status'         : task_status,
-    }
 
-    progress = ''
-    if datasets_in:
-      dsinfo = task['dsinfo']
-      nfiles = dsinfo['nfiles']
-      nfiles_finished = dsinfo['nfilesfinished']
-      nevents = dsinfo['neventsTot']
-      nevents_processed = dsinfo['neventsUsedTot']
-      pct = nevents_processed / nevents * 100
-      nevents_str = int_to_si(nevents)
-      nevents_processed_str = int_to_si(nevents_processed)
-
-      tasks_summary[task_id].update({
-        'nfiles_out' : nfiles,
-        'nfiles_done' : nfiles_finished,
-        'nevents' : nevents_str,
-        'nevents_processed' : nevents_processed_str,
-        'percentage' : pct,
-      })
-
-      progress = f' ({nfiles_finished}/{nfiles} {pluralize("file", nfiles)}, {nevents_processed_str}/{nevents_str} events, {pct:.0f}%)'
-    print(f'  {boldify("STATUS")}: {colorize(task_status)}{progress}')
-
-    task_content = get_task(task_id)
-    task_jobs = task_content['jobs']
-    task_errs = task_content['errsByCount']
-
-    unique_jobs = {}
-    task_site_stats = {}
-    task_site_attempts = {}
-
-    for job_info in task_jobs:
-      if job_info['prodsourcelabel'] != 'user':
-        # Consider only user runGen jobs
+def print_task_datasets(
+      rucio_client: 'Client',
+      datasets_in: typing.List[str],
+      datasets_out: typing.List[str],
+      batch_size: int = REPLICA_BATCH_SIZE,
+      with_files: bool = True,
+    ) -> typing.Tuple[dict, dict]:
+  dataset_in_info = {}
+  dataset_out_info = {}
+  OUTPUT.text(f'  {boldify("IN")}:     {datasets_in[0] if datasets_in else "n/a"}')
+  if datasets_in and with_files:
+    dataset_in_info.update(print_dataset_info(rucio_client, datasets_in[0], 12, batch_size))
+  if len(datasets_in) > 1:
+    for dataset_in in datasets_in[1:]:
+      OUTPUT.text(f'          {dataset_in}')
+      if with_files:
+        dataset_in_info.update(print_dataset_info(rucio_client, dataset_in, 12, batch_size))
+  OUTPUT.text(f'  {boldify("OUT")}:    {datasets_out[0] if datasets_out else "n/a"}')
+  if datasets_out and with_files:
+    dataset_out_info.update(print_dataset_info(rucio_client, datasets_out[0], 12, batch_size))
+  if len(datasets_out) > 1:
+    for dataset_out in datasets_out[1:]:
+      OUTPUT.text(f'          {dataset_out}')
+      if with_files:
+        dataset_out_info.update(print_dataset_info(rucio_client, dataset_out, 12, batch_size))
+  return dataset_in_info, dataset_out_info
+
+
+def collect_task_jobs(task: dict, args: argparse.Namespace, error_messages: dict, refresh: bool = False) -> JobTable:
+  task_id = task['jeditaskid']
+  columns = { key : [] for key in [
+    'pandaid', 'chain_id', 'computingsite', 'jobstatus', 'taskbuffererrorcode', 'creationtime', 'endtime',
+  ] }
+  task_errs = []
+
+  # the jobs are processed one by one as they are parsed from the response
+  task_records = iter_task(
+    task_id, task['status'], task.get('modificationtime', ''), task.get('creationdate', ''), args.page_size, refresh,
+  )
+  is_complete = True
+  try:
+    for record_key, record in PROFILER.iter_phase('job listing', task_records):
+      if record_key == 'errsByCount':
+        task_errs.extend(record)
         continue
+      if record_key != 'jobs':
+        continue
+      job_record = record
+      if job_record.prodsourcelabel != 'user':
+        # Consider only user runGen jobs, in case bigpanda did not apply the filter
+        continue
+      for key, column in columns.items():
+        column.append(getattr(job_record, key))
+  except IncompleteResponse:
+    is_complete = False
+    OUTPUT.text(f'The job listing of task {task_id} is incomplete')
+
+  # the errors may come before or after the jobs in the response, hence they are matched to the jobs only at the end
+  for task_err in task_errs:
+    error_code = task_err['error']
+    if error_code not in PANDA_ERRORS and error_code not in error_messages:
+      error_messages[error_code] = task_err['diag']
+  with PROFILER.phase('job table'):
+    return JobTable(columns, index_errors(task_errs), is_complete)
+
+
+def ingest_task_jobs(task: dict, job_table: JobTable, error_messages: dict) -> None:
+  # only the jobs in a final state are stored, the rest is picked up by a later run once they are done; a task is
+  # marked as stored only if it is final and its job listing is complete, otherwise it is fetched again next time
+  done_rows = np.flatnonzero(job_table.is_done)
+  err_offsets = job_table.err_offsets.tolist()
+  err_codes = job_table.err_codes_by_row.tolist()
+  jobs = [
+    (job_id, job_table.site_names[site], [ job_table.err_names[code] for code in err_codes[err_offsets[row]:err_offsets[row + 1]] ],
+     is_retasked, start, end)
+    for row, job_id, site, is_retasked, start, end in zip(
+      done_rows.tolist(), job_table.ids[done_rows].tolist(), job_table.sites[done_rows].tolist(),
+      job_table.is_retasked[done_rows].tolist(), job_table.start[done_rows].tolist(), job_table.end[done_rows].tolist(),
+    )
+  ]
+  is_final = task['status'] in TASK_FINAL_STATUSES and job_table.is_complete
+  HISTORY.ingest(task['jeditaskid'], jobs, error_messages, task.get('modificationtime', '') if is_final else None)
+
+
+def print_chain(unique_jobs_id: typing.List[dict], job_chain_elapsed: str, job_status: str, job_chain_files: dict) -> None:
+  job_ids_per_line = 8
+  job_chain_str = ''
+  job_chain_str_indent = ''
+  num_unique_jobs_id = len(unique_jobs_id)
+  for line_num in range(0, num_unique_jobs_id, job_ids_per_line):
+    if line_num > 0:
+      job_chain_str += ' ->\n'
+    job_chain_chunk = unique_jobs_id[line_num:line_num + job_ids_per_line]
+    if not job_chain_str_indent:
+      job_chain_str_indent = ' ' * (len(str(job_chain_chunk[0]['id'])) + 4) + ' -> '
+    else:
+      job_chain_str += job_chain_str_indent
+    job_chain_str += ' -> '.join([ get_job_id_str(job_chunk) for job_chunk in job_chain_chunk ])
+  OUTPUT.text(f'    {job_chain_str}')
+  OUTPUT.text(f'        # resubmissions: {num_unique_jobs_id - 1}')
+  OUTPUT.text(f'        time elapsed:    {job_chain_elapsed}')
+  if job_chain_files:
+    OUTPUT.text(f'        log file:        {job_chain_files["log_file"]}')
+    if job_chain_files['input_files']:
+      for input_file in job_chain_files['input_files']:
+        OUTPUT.text(f'                         {input_file}')
+    else:
+      OUTPUT.text(f'        inputs:          n/a')
+    OUTPUT.text(f'        output:          {job_chain_files["output_file"]}')
+  OUTPUT.text(f'        status:          {colorize(job_status.upper())}')
+
+
+def format_chain_line(
+      job_table: JobTable,
+      chain_rows: np.ndarray,
+      job_chain_elapsed: str,
+      job_status: str,
+      job_chain_files: dict,
+    ) -> str:
+  job_ids = ' -> '.join(
+    f'({job_id})' if is_retasked else str(job_id)
+    for job_id, is_retasked in zip(job_table.ids[chain_rows].tolist(), job_table.is_retasked[chain_rows].tolist())
+  )
+  sites = ', '.join(dict.fromkeys(job_table.site_names[site] for site in job_table.sites[chain_rows].tolist()))
+  num_resubmissions = len(chain_rows) - 1
+  line = (
+    f'    {job_ids}: {colorize(job_status.upper())}, {num_resubmissions} {pluralize("resubmission", num_resubmissions)}, '
+    f'{job_chain_elapsed or "0 seconds"}, {sites}'
+  )
+  if job_chain_files:
+    line += f', output: {job_chain_files["output_file"]}'
+  return line
+
+
+def get_num_shown_chains(job_table: JobTable, max_chains: int) -> int:
+  return min(max_chains, job_table.num_chains()) if max_chains else job_table.num_chains()
+
+
+def run_pipeline(
+      items: typing.Iterable[typing.Any],
+      stages: typing.List[typing.Callable[[typing.Any], typing.Any]],
+      depth: int = PIPELINE_DEPTH,
+    ) -> typing.Iterator[typing.Any]:
+  # every stage runs in a thread of its own and hands its results to the next stage through a bounded queue, so that
+  # the stages work on different items at the same time, while the items still come out in the order they went in
+  done = object()
+  queues = [ queue.Queue(maxsize = depth) for _ in range(len(stages) + 1) ]
+  # set once the consumer stops, e.g. because it raised or was closed, so that the threads do not block forever on
+  # full queues and let go of the items they hold
+  stop = threading.Event()
+
+  def put(queue_out: queue.Queue, entry: tuple) -> bool:
+    while not stop.is_set():
+      try:
+        queue_out.put(entry, timeout = PIPELINE_POLL_INTERVAL)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def get(queue_in: queue.Queue) -> typing.Optional[tuple]:
+    while not stop.is_set():
+      try:
+        return queue_in.get(timeout = PIPELINE_POLL_INTERVAL)
+      except queue.Empty:
+        pass
+    return None
+
+  def feed() -> None:
+    for item in items:
+      if not put(queues[0], (item, None)):
+        return
+    put(queues[0], (done, None))
+
+  def work(stage: typing.Callable[[typing.Any], typing.Any], queue_in: queue.Queue, queue_out: queue.Queue) -> None:
+    while True:
+      entry = get(queue_in)
+      if entry is None:
+        return
+      item, error = entry
+      if item is not done and error is None:
+        try:
+          item = stage(item)
+        except Exception as e:
+          error = e
+      if not put(queue_out, (item, error)) or item is done:
+        return
+
+  threads = [ threading.Thread(target = feed, daemon = True) ] + [
+    threading.Thread(target = work, args = (stage, queues[stage_idx], queues[stage_idx + 1]), daemon = True)
+    for stage_idx, stage in enumerate(stages)
+  ]
+  for thread in threads:
+    thread.start()
+  try:
+    while True:
+      item, error = queues[-1].get()
+      if error is not None:
+        raise error
+      if item is done:
+        return
+      yield item
+  finally:
+    stop.set()
+    # the queued items are dropped right away rather than once the threads notice the stop
+    for stage_queue in queues:
+      while True:
+        try:
+          stage_queue.get_nowait()
+        except queue.Empty:
+          break
+
+
+def fetch_task_datasets(task_data: dict, rucio_client: 'Client', args: argparse.Namespace) -> dict:
+  # the dataset info is only fetched here, it is memoised and printed from memory later on
+  if not args.no_datasets:
+    with PROFILER.phase('dataset info'):
+      for dataset in itertools.chain(*get_task_datasets(task_data['task'])):
+        get_dataset_info(rucio_client, dataset, args.replica_batch_size)
+  return task_data
+
+
+def fetch_task_jobs(task_data: dict, args: argparse.Namespace, error_messages: dict) -> dict:
+  task = task_data['task']
+  task_data['job_table'] = collect_task_jobs(task, args, error_messages, task_data['refresh'])
+  if HISTORY:
+    with PROFILER.phase('history'):
+      if not HISTORY.is_ingested(task['jeditaskid'], task.get('modificationtime', '')):
+        ingest_task_jobs(task, task_data['job_table'], error_messages)
+  return task_data
+
+
+def fetch_task_job_details(task_data: dict, args: argparse.Namespace) -> dict:
+  # the job records are fetched from /job only if the file names are needed, everything else is in the /jobs listing
+  # --max-chains truncates only the text report, every chain still gets its NDJSON record
+  job_table = task_data['job_table']
+  num_chains = job_table.num_chains() if OUTPUT.mode == 'ndjson' else get_num_shown_chains(job_table, args.max_chains)
+  if args.show_files:
+    with PROFILER.phase('job details'):
+      task_data['job_chain_infos'] = get_jobs(
+        [ int(job_table.ids[job_table.chain(chain_idx)[-1]]) for chain_idx in range(num_chains) ], args.jobs,
+        task_data['refresh'],
+      )
+  else:
+    task_data['job_chain_infos'] = [ None ] * num_chains
+  return task_data
+
+
+def process_task(
+      task: dict,
+      rucio_client: 'Client',
+      args: argparse.Namespace,
+      error_messages: dict,
+      job_table: JobTable,
+      job_chain_infos: typing.List[typing.Optional[dict]],
+    ) -> typing.Tuple[dict, SiteStats]:
+  task_id = task['jeditaskid']
+  datasets_in, datasets_out = get_task_datasets(task)
+
+  OUTPUT.text(f'{boldify("TASK")} {task_id}:')
+  with PROFILER.phase('dataset info'):
+    dataset_in_info, dataset_out_info = print_task_datasets(
+      rucio_client, datasets_in, datasets_out, args.replica_batch_size, not args.no_datasets,
+    )
+
+  task_status = task['status']
+  task_summary = {
+    'datasets_in'    : datasets_in,
+    'datasets_out'   : datasets_out,
+    'total_attempts' : 0,
+    'status'         : task_status,
+  }
 
-      jobid = job_info['pandaid']
-
-      jobid_original_match = JOB_ID_RGX.search(job_info['jobname'])
-      jobid_original = int(jobid_original_match.group(1)) if jobid_original_match else jobid
-
-      jobid_str = str(jobid)
-      job_errs = []
-      for task_err in task_errs:
-        if jobid_str in task_err['pandalist']:
-          error_code = task_err['error']
-          if error_code not in PANDA_ERRORS and error_code not in error_messages:
-            error_messages[error_code] = task_err['diag']
-          job_errs.append(error_code)
-
-      if jobid_original not in unique_jobs:
-        unique_jobs[jobid_original] = []
-      job_site = job_info['computingsite']
-      is_retasked = job_info['taskbuffererrorcode'] != 0 # reassigned by jedi or killed by panda
-      is_done = job_info['jobstatus'] in [ 'failed', 'finished' ]
-      unique_jobs[jobid_original].append({
-        'id'          : jobid,
-        'site'        : job_site,
-        'errs'        : job_errs,
-        'is_retasked' : is_retasked,
-        'is_done'     : is_done,
-      })
-
-
-    print(f'  {boldify("JOBS")} ({len(unique_jobs)}):')
-    earliest_time = time.time()
-    latest_time = 0
-    for jobid_original in unique_jobs:
-      unique_jobs_id = list(sorted(unique_jobs[jobid_original], key = lambda kv: kv['id']))
-
-      first_job_id = unique_jobs_id[0]['id']
-      latest_job_id = unique_jobs_id[-1]['id']
-
-      job_info = get_job(latest_job_id)
-
+  progress = ''
+  if datasets_in:
+    dsinfo = task['dsinfo']
+    nfiles = dsinfo['nfiles']
+    nfiles_finished = dsinfo['nfilesfinished']
+    nevents = dsinfo['neventsTot']
+    nevents_processed = dsinfo['neventsUsedTot']
+    pct = nevents_processed / nevents * 100
+    nevents_str = int_to_si(nevents)
+    nevents_processed_str = int_to_si(nevents_processed)
+
+    task_summary.update({
+      'nfiles_out' : nfiles,
+      'nfiles_done' : nfiles_finished,
+      'nevents' : nevents_str,
+      'nevents_processed' : nevents_processed_str,
+      'percentage' : pct,
+    })
+
+    progress = f' ({nfiles_finished}/{nfiles} {pluralize("file", nfiles)}, {nevents_processed_str}/{nevents_str} events, {pct:.0f}%)'
+  OUTPUT.text(f'  {boldify("STATUS")}: {colorize(task_status)}{progress}')
+
+  OUTPUT.text(f'  {boldify("JOBS")} ({job_table.num_chains()}):')
+  job_chains = [ job_table.chain(chain_idx) for chain_idx in range(job_table.num_chains()) ]
+  # the per-chain statistics are needed only for the chains that are printed in full or get an NDJSON record, which
+  # are the ones gone through below
+  chains_site_stats = job_table.chain_site_stats(0 if args.compact and OUTPUT.mode != 'ndjson' else len(job_chain_infos))
+  num_shown = get_num_shown_chains(job_table, args.max_chains)
+  counted_chains = []
+  for chain_idx, (chain_rows, job_info) in enumerate(zip(job_chains, job_chain_infos)):
+    job_chain_files = {}
+    if job_info is not None:
       job_files = job_info['files']
       input_files = get_input_lfns(job_files, datasets_in)
-      output_file = get_output_lfn(job_files, 'output')
-      log_file = get_output_lfn(job_files, 'log')
       if not input_files and datasets_in:
         continue
+      job_chain_files = {
+        'log_file'    : get_output_lfn(job_files, 'log'),
+        'input_files' : input_files,
+        'output_file' : get_output_lfn(job_files, 'output'),
+      }
+      job_status = job_info['job']['jobstatus']
+    else:
+      job_status = job_table.statuses[chain_rows[-1]]
+
+    counted_chains.append(chain_idx)
+    job_chain_start = int(job_table.chain_start[chain_idx])
+    job_chain_end = int(job_table.chain_end[chain_idx])
+    job_chain_elapsed = seconds_to_human_readable(job_chain_end - job_chain_start)
+    is_shown = chain_idx < num_shown
+    if args.compact and is_shown:
+      OUTPUT.text(format_chain_line(job_table, chain_rows, job_chain_elapsed, job_status, job_chain_files))
+    if args.compact and OUTPUT.mode != 'ndjson':
+      continue
+    unique_jobs_id = [ job_table.job(row) for row in chain_rows ]
+    site_stats = chains_site_stats[chain_idx]
+    if is_shown and not args.compact:
+      print_chain(unique_jobs_id, job_chain_elapsed, job_status, job_chain_files)
+      print_stats(site_stats, error_messages, 4)
+    OUTPUT.record('chain', {
+      'task_id'     : task_id,
+      'jobs'        : unique_jobs_id,
+      'start'       : job_chain_start,
+      'end'         : job_chain_end,
+      **job_chain_files,
+      'status'      : job_status,
+      'site_stats'  : site_stats.to_dict(),
+    })
+
+  # the truncated chains are not printed but still count towards the task statistics; in the NDJSON mode they have
+  # been gone through above already, for their records
+  if num_shown < len(job_chains):
+    num_hidden = len(job_chains) - num_shown
+    OUTPUT.text(f'    ... {num_hidden} more job {pluralize("chain", num_hidden)} not shown')
+    counted_chains.extend(range(len(job_chain_infos), len(job_chains)))
+
+  earliest_time = int(job_table.chain_start[counted_chains].min(initial = time.time()))
+  latest_time = int(job_table.chain_end[counted_chains].max(initial = 0))
+  counted_rows = [ job_chains[chain_idx] for chain_idx in counted_chains ]
+  task_site_stats = job_table.site_stats(np.concatenate(counted_rows) if counted_rows else np.zeros(0, dtype = np.int64))
+  task_summary['total_attempts'] = task_site_stats.total_attempts()
+
+  OUTPUT.text(f'  {boldify("TOTAL TIME ELAPSED")}: {seconds_to_human_readable(latest_time - earliest_time)}')
+  print_stats(task_site_stats, error_messages, 2)
+  OUTPUT.record('task', {
+    'task_id'    : task_id,
+    **task_summary,
+    'start'      : earliest_time,
+    'end'        : latest_time,
+    'datasets'   : { 'in' : dataset_in_info, 'out' : dataset_out_info },
+    'site_stats' : task_site_stats.to_dict(),
+  })
+
+  return task_summary, task_site_stats
+
+
+def get_statuses(args: argparse.Namespace) -> str:
+  statuses_include = STATUSES if not args.status_include else args.status_include
+  statuses_exclude = args.status_exclude
+  return ','.join(sorted(set(statuses_include) - set(statuses_exclude)))
 
-      job_chain_start = get_start_time(task_jobs, first_job_id)
-      job_chain_end = get_end_time(task_jobs, latest_job_id)
-      job_chain_elapsed = seconds_to_human_readable(job_chain_end - job_chain_start)
-
-      earliest_time = min(earliest_time, job_chain_start)
-      latest_time = max(latest_time, job_chain_end)
-
-      job_ids_per_line = 8
-      job_chain_str = ''
-      job_chain_str_indent = ''
-      num_unique_jobs_id = len(unique_jobs_id)
-      for line_num in range(0, num_unique_jobs_id, job_ids_per_line):
-        if line_num > 0:
-          job_chain_str += ' ->\n'
-        job_chain_chunk = unique_jobs_id[line_num:line_num + job_ids_per_line]
-        if not job_chain_str_indent:
-          job_chain_str_indent = ' ' * (len(str(job_chain_chunk[0]['id'])) + 4) + ' -> '
-        else:
-          job_chain_str += job_chain_str_indent
-        job_chain_str += ' -> '.join([ get_job_id_str(job_chunk) for job_chunk in job_chain_chunk ])
-      print(f'    {job_chain_str}')
-      print(f'        # resubmissions: {num_unique_jobs_id - 1}')
-      print(f'        time elapsed:    {job_chain_elapsed}')
-      print(f'        log file:        {log_file}')
-      if input_files:
-        for input_file in input_files:
-          print(f'                         {input_file}')
-      else:
-        print(f'        inputs:          n/a')
-      print(f'        output:          {output_file}')
-      print(f'        status:          {colorize(job_info["job"]["jobstatus"].upper())}')
-
-      site_stats = {}
-      site_attempts = {}
-      for job_stats in unique_jobs_id:
-        site = job_stats['site']
-        errs = job_stats['errs']
-        if site not in site_stats:
-          site_stats[site] = {}
-        if site not in site_attempts:
-          site_attempts[site] = 0
-
-        if not job_stats['is_retasked'] and job_stats['is_done']:
-          for err in errs:
-            if err not in site_stats[site]:
-              site_stats[site][err] = 0
-            site_stats[site][err] += 1
-          if not errs :
-            if PANDA_NO_ERROR not in site_stats[site]:
-              site_stats[site][PANDA_NO_ERROR] = 0
-            site_stats[site][PANDA_NO_ERROR] += 1
 
-          site_attempts[site] += 1
-      print_stats(site_stats, site_attempts, error_messages, 4)
+def read_queries(path: str, args: argparse.Namespace) -> typing.List[typing.Tuple[str, argparse.Namespace]]:
+  # every non-empty line holds the query options of a single run, e.g. -u <user> -c <pattern> -s running -d 7
+  queries = []
+  with open(path) as batch_file:
+    for line in batch_file:
+      line = line.strip()
+      if not line or line.startswith('#'):
+        continue
+      query_args = get_args(shlex.split(line))
+      query = argparse.Namespace(**vars(args))
+      for option in QUERY_OPTIONS:
+        setattr(query, option, getattr(query_args, option))
+      queries.append((line, query))
+  return queries
+
+
+def run_query(
+      args: argparse.Namespace,
+      name: str,
+      rucio_client: 'Client',
+      error_messages: dict,
+      task_states: dict,
+    ) -> typing.Tuple[dict, SiteStats]:
+  # the task list is always refetched in the watch mode, because it is what tells which tasks have changed
+  with PROFILER.phase('task listing'):
+    tasks = pbook(
+      name, contains = args.contains, status = get_statuses(args), days = args.days, refresh = bool(args.watch), page_size = args.page_size,
+      task_ids = args.task_id,
+    )
+  num_tasks = len(tasks)
+  OUTPUT.text(boldify(f'Found {num_tasks} {pluralize("task", num_tasks)}'))
+  OUTPUT.flush()
 
-      task_site_stats = merge_stats(task_site_stats, site_stats)
-      task_site_attempts = merge_attempts(task_site_attempts, site_attempts)
+  selected_tasks = {}
+  for task_idx, task in enumerate(tasks):
+    task_id = task['jeditaskid']
+    # bigpanda is asked for the selected tasks only, this is in case it ignores the filter
+    if args.task_id and task_id not in args.task_id:
+      continue
+    selected_tasks[task_id] = task_idx
+
+  changed_tasks = [
+    task_id for task_id in selected_tasks
+    if task_id not in task_states or task_states[task_id]['signature'] != get_task_signature(tasks[selected_tasks[task_id]])
+  ]
+  if args.watch and task_states:
+    OUTPUT.text(boldify(f'{len(changed_tasks)} {pluralize("task", len(changed_tasks))} changed'))
+
+  for task_id in list(task_states):
+    if task_id not in selected_tasks:
+      del task_states[task_id]
+
+  # the dataset info, the job listing and the job details of the next tasks are fetched while a task is printed; a
+  # task that has changed since it was last shown may not have a new modification time, which is part of the cache
+  # key of its jobs, hence its jobs are refetched
+  task_pipeline = run_pipeline(
+    [ { 'task' : tasks[selected_tasks[task_id]], 'refresh' : task_id in task_states } for task_id in changed_tasks ],
+    [
+      lambda task_data: fetch_task_datasets(task_data, rucio_client, args),
+      lambda task_data: fetch_task_jobs(task_data, args, error_messages),
+      lambda task_data: fetch_task_job_details(task_data, args),
+    ],
+  )
+  for task_data in task_pipeline:
+    task = task_data['task']
+    task_id = task['jeditaskid']
+    task_idx = selected_tasks[task_id]
+    with PROFILER.phase('job loop'):
+      task_summary, task_site_stats = process_task(
+        task, rucio_client, args, error_messages, task_data['job_table'], task_data['job_chain_infos'],
+      )
+    task_states[task_id] = {
+      'signature'  : get_task_signature(task),
+      'summary'    : task_summary,
+      'site_stats' : task_site_stats,
+    }
 
-      tasks_summary[task_id]['total_attempts'] += sum(site_attempts.values())
+    if task_idx < (num_tasks - 1):
+      OUTPUT.text('\n\n')
+    OUTPUT.flush()
 
-    print(f'  {boldify("TOTAL TIME ELAPSED")}: {seconds_to_human_readable(latest_time - earliest_time)}')
-    print_stats(task_site_stats, task_site_attempts, error_messages, 2)
+  all_site_stats = SiteStats()
+  tasks_summary = {}
+  for task_id in selected_tasks:
+    all_site_stats.update(task_states[task_id]['site_stats'])
+    tasks_summary[task_id] = task_states[task_id]['summary']
 
+  print_stats(all_site_stats, error_messages)
+  OUTPUT.record('site_stats', { 'site_stats' : all_site_stats.to_dict(), 'error_messages' : error_messages })
+  print_summary(tasks_summary)
+  OUTPUT.flush()
+  return tasks_summary, all_site_stats
+
+
+def run_history_query(args: argparse.Namespace, name: str, error_messages: dict) -> SiteStats:
+  # only the tasks that have changed since they were last stored are fetched, the statistics come from the store
+  with PROFILER.phase('task listing'):
+    tasks = pbook(
+      name, contains = args.contains, status = get_statuses(args), days = args.site_history, page_size = args.page_size,
+      task_ids = args.task_id,
+    )
+  tasks = [ task for task in tasks if not args.task_id or task['jeditaskid'] in args.task_id ]
+  pending_tasks = [ task for task in tasks if not HISTORY.is_ingested(task['jeditaskid'], task.get('modificationtime', '')) ]
+  OUTPUT.text(boldify(
+    f'Found {len(tasks)} {pluralize("task", len(tasks))}, {len(pending_tasks)} of them not yet in the site history'
+  ))
+  OUTPUT.flush()
+  for task in pending_tasks:
+    job_table = collect_task_jobs(task, args, error_messages)
+    with PROFILER.phase('history'):
+      ingest_task_jobs(task, job_table, error_messages)
+
+  with PROFILER.phase('history'):
+    since = time.time() - args.site_history * 24 * 3600
+    site_stats = HISTORY.get_site_stats([ task['jeditaskid'] for task in tasks ], since)
+    for error_code, error_message in HISTORY.get_error_messages().items():
+      error_messages.setdefault(error_code, error_message)
+  OUTPUT.text(boldify(f'SITE RELIABILITY OVER THE LAST {args.site_history} {pluralize("day", args.site_history).upper()}'))
+  print_stats(site_stats, error_messages)
+  OUTPUT.record('site_history', {
+    'days' : args.site_history, 'site_stats' : site_stats.to_dict(), 'error_messages' : error_messages,
+  })
+  return site_stats
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  daemon_threads = True
+
+  def server_bind(self) -> None:
+    # the socket is created accessible to its owner only
+    umask = os.umask(0o177)
+    try:
+      super().server_bind()
+    finally:
+      os.umask(umask)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+  def __init__(self, socket_path: str):
+    super().__init__('localhost')
+    self.socket_path = socket_path
+
+  def connect(self) -> None:
+    # only connecting is subject to the timeout, running the query may take long
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.sock.settimeout(DAEMON_CONNECT_TIMEOUT)
+    self.sock.connect(self.socket_path)
+    self.sock.settimeout(None)
+
+
+def is_own_socket(path: str) -> bool:
+  try:
+    stat = os.stat(path)
+  except OSError:
+    return False
+  return stat.st_uid == os.getuid() and not stat.st_mode & 0o077
+
+
+class Daemon:
+  # keeps the HTTP pools, the Rucio client and the caches warm between queries; the queries run one at a time, because
+  # they share the global output and state, and those that are still being asked for are rerun in the background
+  def __init__(self, args: argparse.Namespace, rucio_client: 'Client'):
+    self.args = args
+    self.rucio_client = rucio_client
+    self.refresh = args.watch if args.watch else DAEMON_REFRESH
+    # guards the results as well as the queries, which take it again while they run
+    self.lock = threading.RLock()
+    self.names = {}
+    self.error_messages = {}
+    self.results = {}
+
+  def get_query(self, argv: typing.List[str]) -> argparse.Namespace:
+    query_args = get_args(argv)
+    query = argparse.Namespace(**vars(self.args))
+    for option in DAEMON_OPTIONS:
+      setattr(query, option, getattr(query_args, option))
+    # the task listing is refetched whenever a query is rerun, like in the watch mode
+    query.watch = self.refresh
+    return query
+
+  @staticmethod
+  def get_key(query: argparse.Namespace) -> str:
+    # the options that do not change the result, such as the output mode, do not make a different query
+    return json.dumps([ getattr(query, option) for option in DAEMON_OPTIONS ])
+
+  def run(self, argv: typing.List[str]) -> dict:
+    global OUTPUT
+    query = self.get_query(argv)
+    with self.lock:
+      if query.user not in self.names:
+        self.names[query.user] = query.user if query.user else get_CRIC_name()
+      output = OUTPUT
+      OUTPUT = CaptureOutput()
+      try:
+        tasks_summary, site_stats = run_query(query, self.names[query.user], self.rucio_client, self.error_messages, {})
+        response = {
+          'tasks_summary'  : tasks_summary,
+          'site_stats'     : site_stats.to_dict(),
+          'error_messages' : dict(self.error_messages),
+          'report'         : OUTPUT.report(),
+          'records'        : OUTPUT.records,
+          'updated'        : time.time(),
+        }
+      finally:
+        OUTPUT = output
+      key = self.get_key(query)
+      self.results[key] = { 'argv' : argv, 'response' : response, 'requested' : self.results.get(key, {}).get('requested', 0) }
+      return response
+
+  def get(self, argv: typing.List[str]) -> dict:
+    key = self.get_key(self.get_query(argv))
+    with self.lock:
+      result = self.results.get(key)
+      if result is None or time.time() - result['response']['updated'] > self.refresh:
+        self.run(argv)
+        result = self.results[key]
+      result['requested'] = time.time()
+      return result['response']
+
+  def status(self) -> dict:
+    now = time.time()
+    with self.lock:
+      return {
+        'queries' : [
+          { 'argv' : result['argv'], 'age' : now - result['response']['updated'], 'idle' : now - result['requested'] }
+          for result in self.results.values()
+        ],
+      }
+
+  def refresh_loop(self) -> None:
+    while True:
+      time.sleep(self.refresh)
+      with self.lock:
+        results = list(self.results.items())
+      for key, result in results:
+        with self.lock:
+          if time.time() - result['requested'] > DAEMON_IDLE_TIME:
+            self.results.pop(key, None)
+            continue
+        try:
+          self.run(result['argv'])
+        except Exception as e:
+          sys.stderr.write(f'Failed to refresh {" ".join(result["argv"])}: {e}\n')
+
+  def serve(self, socket_path: str) -> None:
+    daemon = self
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+      def address_string(self) -> str:
+        # the clients of a Unix socket have no address
+        return socket_path
+
+      def send_json(self, status: int, data: dict) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def do_GET(self) -> None:
+        if urllib.parse.urlparse(self.path).path == '/status':
+          self.send_json(200, daemon.status())
+        else:
+          self.send_json(404, { 'error' : f'Unknown endpoint: {self.path}' })
+
+      def do_POST(self) -> None:
+        if urllib.parse.urlparse(self.path).path != '/query':
+          self.send_json(404, { 'error' : f'Unknown endpoint: {self.path}' })
+          return
+        try:
+          request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+          self.send_json(200, daemon.get(request.get('argv', [])))
+        except SystemExit:
+          self.send_json(400, { 'error' : f'Invalid query: {request.get("argv")}' })
+        except Exception as e:
+          self.send_json(500, { 'error' : str(e) })
+
+    # a socket that is left over from a daemon that did not exit cleanly is replaced, one that is in use is not
+    if os.path.exists(socket_path):
+      if query_daemon_status(socket_path) is not None:
+        raise RuntimeError(f'A daemon is already serving on {socket_path}')
+      os.remove(socket_path)
+    os.makedirs(os.path.dirname(socket_path), mode = 0o700, exist_ok = True)
+    threading.Thread(target = self.refresh_loop, daemon = True).start()
+    server = UnixHTTPServer(socket_path, Handler)
+    OUTPUT.text(f'Serving on {socket_path}, refreshing the queries every {self.refresh} seconds')
+    OUTPUT.flush()
+    try:
+      server.serve_forever()
+    finally:
+      server.server_close()
+      os.remove(socket_path)
+
+
+def request_daemon(socket_path: str, method: str, path: str, data: typing.Optional[dict] = None) -> typing.Optional[dict]:
+  # anything but a JSON object from a socket of the same user, be it no daemon, an error or a reply from something
+  # else, is treated as if there were no daemon
+  if not is_own_socket(socket_path):
+    return None
+  connection = UnixHTTPConnection(socket_path)
+  try:
+    body = json.dumps(data).encode() if data is not None else None
+    connection.request(method, path, body = body, headers = { 'Content-Type' : 'application/json' })
+    response = connection.getresponse()
+    status, reply = response.status, json.loads(response.read())
+  except (OSError, http.client.HTTPException, ValueError):
+    return None
+  finally:
+    connection.close()
+  if not isinstance(reply, dict):
+    return None
+  if status != 200:
+    sys.stderr.write(f'The daemon failed to run the query, running it locally: {reply.get("error", status)}\n')
+    return None
+  return reply
+
+
+def query_daemon_status(socket_path: str = DAEMON_SOCKET) -> typing.Optional[dict]:
+  return request_daemon(socket_path, 'GET', '/status')
+
+
+def query_daemon(argv: typing.List[str], socket_path: str = DAEMON_SOCKET) -> typing.Optional[dict]:
+  response = request_daemon(socket_path, 'POST', '/query', { 'argv' : argv })
+  if response is None or not all(key in response for key in [ 'report', 'records' ]):
+    return None
+  return response
+
+
+def print_daemon_response(response: dict) -> None:
+  if OUTPUT.mode == 'text':
+    OUTPUT.text(response['report'].rstrip('\n'))
+    return
+  for record in response['records']:
+    OUTPUT.record(record.pop('type'), record)
+
+
+def main(argv: typing.Optional[typing.List[str]] = None) -> None:
+  global BIGPANDA_URL, TRANSPORT, CACHE, CACHE_TTL, REPLICA_TTL, OUTPUT, HISTORY
+
+  argv = sys.argv[1:] if argv is None else argv
+  args = get_args(argv)
+  BIGPANDA_URL = args.bigpanda_url.rstrip('/')
+  OUTPUT = Output(args.output)
+
+  # a running daemon answers plain queries; anything else, i.e. a query with an option outside of the daemon queries
+  # that is not at its default, be it for local state, fresh data or a different server, is run here
+  defaults = get_args([])
+  local_options = [
+    option for option, value in vars(args).items()
+    if option not in DAEMON_OPTIONS + DAEMON_CLIENT_OPTIONS and value != getattr(defaults, option)
+  ]
+  if not args.no_daemon and not local_options:
+    response = query_daemon(argv, args.daemon_socket)
+    if response is not None:
+      print_daemon_response(response)
+      OUTPUT.flush()
+      return
+
+  TRANSPORT = Transport(args.timeout, args.retries, args.rate, args.max_per_host)
+  CACHE_TTL = args.cache_ttl
+  REPLICA_TTL = args.replica_ttl
+  if not args.no_cache:
+    CACHE = ResponseCache(CACHE_PATH, args.cache_size, args.refresh)
+  if not args.no_history:
+    HISTORY = SiteHistory(HISTORY_PATH)
+  elif args.site_history:
+    raise RuntimeError('The site history cannot be queried with --no-history')
+  if args.download and (args.site_history or args.no_datasets):
+    raise RuntimeError('The datasets can be downloaded neither from the site history nor with --no-datasets')
+
+  rucio_client = LazyRucioClient()
+
+  queries = read_queries(args.batch, args) if args.batch else [ ('', args) ]
+  query_states = [ {} for _ in queries ]
+  names = {}
+  error_messages = {}
 
-    all_site_stats = merge_stats(all_site_stats, task_site_stats)
-    all_site_attempts = merge_attempts(all_site_attempts, task_site_attempts)
+  try:
+    if args.serve:
+      Daemon(args, rucio_client).serve(args.daemon_socket)
+      return
+    while True:
+      if args.watch:
+        OUTPUT.text(boldify(f'{datetime.datetime.now():%Y-%m-%d %H:%M:%S}'))
+      combined_site_stats = SiteStats()
+      datasets_to_download = []
+      for query_idx, (query_line, query) in enumerate(queries):
+        if query_line:
+          OUTPUT.text(boldify(f'QUERY {query_idx + 1}/{len(queries)}: {query_line}'))
+        # the CRIC name is looked up only once, no matter how many queries rely on it
+        if query.user not in names:
+          names[query.user] = query.user if query.user else get_CRIC_name()
+        if args.site_history:
+          query_site_stats = run_history_query(query, names[query.user], error_messages)
+        else:
+          tasks_summary, query_site_stats = run_query(query, names[query.user], rucio_client, error_messages, query_states[query_idx])
+          datasets_to_download.extend(dataset for task_summary in tasks_summary.values() for dataset in task_summary['datasets_out'])
+        combined_site_stats.update(query_site_stats)
+        if query_idx < len(queries) - 1:
+          OUTPUT.text('\n\n')
+
+      if len(queries) > 1:
+        OUTPUT.text(boldify(f'\nSITE RELIABILITY ACROSS ALL {len(queries)} QUERIES'))
+        print_stats(combined_site_stats, error_messages)
+        OUTPUT.record('combined_site_stats', { 'site_stats' : combined_site_stats.to_dict(), 'error_messages' : error_messages })
+      if args.download:
+        download_datasets(rucio_client, datasets_to_download, args)
+      OUTPUT.text(f'\nRucio calls: {PROFILER.count("rucio:list_files")} list_files, {PROFILER.count("rucio:list_replicas")} list_replicas')
+
+      if not args.watch:
+        break
+      OUTPUT.flush()
+      time.sleep(args.watch)
+      OUTPUT.text('\n\n')
+  finally:
+    if CACHE:
+      CACHE.close()
+    if HISTORY:
+      HISTORY.close()
+    if args.profile == '-':
+      OUTPUT.text('')
+      print_profile(PROFILER.report())
+    elif args.profile:
+      with open(args.profile, 'w') as profile_file:
+        json.dump(PROFILER.report(), profile_file, indent = 2)
+    OUTPUT.flush()
 
-    if task_idx < (num_tasks - 1):
-      print('\n\n')
 
-  print_stats(all_site_stats, all_site_attempts, error_messages)
-  print_summary(tasks_summary)
+if __name__ == '__main__':
+  main()
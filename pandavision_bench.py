@@ -0,0 +1,462 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import re
+import json
+import queue
+import time
+import types
+import zlib
+import typing
+import random
+import argparse
+import datetime
+import tempfile
+import resource
+import itertools
+import threading
+import http.server
+import urllib.parse
+import multiprocessing
+import tabulate
+
+
+BENCH_USER = 'bench'
+BENCH_SCOPE = f'user.{BENCH_USER}'
+BENCH_DAYS = 14
+
+SITES = [ 'CERN-PROD', 'BNL', 'TRIUMF', 'IN2P3-CC', 'DESY-HH', 'RAL-LCG2', 'INFN-T1', 'NDGF-T1' ]
+RSES = [ f'{site}_DATADISK' for site in SITES ]
+TASK_STATUSES = [ 'done', 'running', 'finished', 'failed' ]
+ERRORS = [
+  ('pilot:1137', 'Failed to stage-out file'),
+  ('sup:9000', 'Worker canceled by harvester'),
+  ('exe:65', 'Non-zero return code from payload'),
+  ('jobdispatcher:100', 'Lost heartbeat'),
+]
+
+# fields that real bigpanda job records carry but pandavision does not use, so that the payloads have a realistic size
+JOB_FILLER = {
+  field : f'{field}-value' for field in [
+    'actualcorecount', 'assignedpriority', 'atlasrelease', 'attemptnr', 'batchid', 'brokerageerrorcode', 'cloud',
+    'cmtconfig', 'commandtopilot', 'computingelement', 'cpuconsumptiontime', 'cpuconsumptionunit', 'currentpriority',
+    'destinationdblock', 'destinationse', 'dispatchdblock', 'ddmerrorcode', 'eventservice', 'exeerrorcode',
+    'gshare', 'homepackage', 'inputfilebytes', 'inputfiletype', 'jobdefinitionid', 'jobdispatchererrorcode',
+    'jobexecutionid', 'jobmetrics', 'jobsetid', 'lockedby', 'maxattempt', 'maxcpucount', 'maxdiskcount', 'maxrss',
+    'minramcount', 'modificationhost', 'nevents', 'ninputdatafiles', 'noutputdatafiles', 'piloterrorcode',
+    'pilotid', 'processingtype', 'produserid', 'reqid', 'resourcetype', 'specialhandling', 'transformation',
+    'transexitcode', 'vo', 'workinggroup', 'workqueue_id',
+  ]
+}
+
+
+def format_time(timestamp: datetime.datetime) -> str:
+  return timestamp.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def get_dataset_names(task_idx: int) -> dict:
+  return {
+    'in'  : f'{BENCH_SCOPE}:{BENCH_SCOPE}.task{task_idx}.in',
+    'out' : f'{BENCH_SCOPE}.task{task_idx}.out/',
+  }
+
+
+def get_file_content(name: str, size: int) -> bytes:
+  # deterministic as well, so that the file server can serve what the Rucio stand-in reports the checksum of
+  return (name.encode() * (size // len(name) + 1))[:size]
+
+
+def get_replica_states(name: str) -> dict:
+  # deterministic, so that the Rucio stand-in does not need to share any state with the bigpanda stand-in
+  seed = zlib.crc32(name.encode())
+  return { rse : 'AVAILABLE' if (seed >> rse_idx) % 3 else 'UNAVAILABLE' for rse_idx, rse in enumerate(RSES) }
+
+
+class SyntheticPayloads:
+  def __init__(self, num_tasks: int, num_jobs: int, num_retries: int, num_files: int, seed: int = 0):
+    rnd = random.Random(seed)
+    now = datetime.datetime.now().replace(microsecond = 0)
+    self.tasks = []
+    self.task_jobs = {}
+    self.jobs = {}
+    pandaid = 4000000000
+    for task_idx in range(num_tasks):
+      task_id = 30000000 + task_idx
+      created = now - datetime.timedelta(days = rnd.randint(1, BENCH_DAYS - 1))
+      datasets = get_dataset_names(task_idx)
+      self.tasks.append({
+        'jeditaskid'       : task_id,
+        'taskname'         : f'{BENCH_SCOPE}.task{task_idx}/',
+        'username'         : BENCH_USER,
+        'status'           : TASK_STATUSES[task_idx % len(TASK_STATUSES)],
+        'creationdate'     : format_time(created),
+        'modificationtime' : format_time(now),
+        'datasets'         : [
+          { 'streamname' : 'IN', 'datasetname' : datasets['in'], 'nfiles' : num_files },
+          { 'streamname' : 'OUTPUT0', 'datasetname' : datasets['out'], 'nfiles' : num_files },
+          { 'streamname' : 'LOG', 'datasetname' : f'{BENCH_SCOPE}.task{task_idx}.log/', 'nfiles' : num_jobs },
+        ],
+        'dsinfo'           : {
+          'nfiles'         : num_files,
+          'nfilesfinished' : num_files,
+          'nfilesfailed'   : 0,
+          'neventsTot'     : num_files * 1000,
+          'neventsUsedTot' : num_files * 1000,
+        },
+      })
+
+      jobs = []
+      errors = {}
+      for job_idx in range(num_jobs):
+        original_pandaid = pandaid
+        start = created + datetime.timedelta(minutes = job_idx)
+        for attempt in range(num_retries + 1):
+          is_last = attempt == num_retries
+          error = None if is_last else rnd.choice(ERRORS)
+          end = start + datetime.timedelta(minutes = rnd.randint(10, 600))
+          job = {
+            **JOB_FILLER,
+            'pandaid'             : pandaid,
+            'jeditaskid'          : task_id,
+            'jobname'             : f'{BENCH_SCOPE}.task{task_idx}/.{original_pandaid}' if attempt else f'{BENCH_SCOPE}.task{task_idx}/',
+            'prodsourcelabel'     : 'user',
+            'computingsite'       : rnd.choice(SITES),
+            'taskbuffererrorcode' : 0 if rnd.random() > 0.05 else 102,
+            'jobstatus'           : 'finished' if is_last else 'failed',
+            'creationtime'        : format_time(start),
+            'endtime'             : format_time(end),
+          }
+          jobs.append(job)
+          self.jobs[pandaid] = (task_idx, job_idx % max(num_files, 1), job)
+          if error:
+            errors.setdefault(error, []).append(pandaid)
+          start = end
+          pandaid += 1
+      self.task_jobs[task_id] = {
+        'jobs'        : jobs,
+        'errsByCount' : [
+          { 'error' : code, 'diag' : diag, 'count' : len(pandalist), 'pandalist' : pandalist }
+          for (code, diag), pandalist in errors.items()
+        ],
+      }
+
+  def get_tasks(self) -> list:
+    return self.tasks
+
+  def get_task(self, task_id: int) -> dict:
+    return self.task_jobs.get(task_id, { 'jobs' : [], 'errsByCount' : [] })
+
+  def get_job(self, pandaid: int) -> dict:
+    task_idx, file_idx, job = self.jobs[pandaid]
+    datasets = get_dataset_names(task_idx)
+    return {
+      'job'   : job,
+      'files' : [
+        { 'type' : 'input', 'scope' : BENCH_SCOPE, 'lfn' : f'{datasets["in"].split(":")[1]}._{file_idx:06d}.root' },
+        { 'type' : 'output', 'scope' : BENCH_SCOPE, 'lfn' : f'{BENCH_SCOPE}.{pandaid}._000001.output.root' },
+        { 'type' : 'log', 'scope' : BENCH_SCOPE, 'lfn' : f'{BENCH_SCOPE}.{pandaid}._000001.log.tgz' },
+      ],
+    }
+
+
+class RecordedPayloads:
+  # replays responses saved from bigpanda: DIR/tasks.json, DIR/jobs/<jeditaskid>.json and DIR/job/<pandaid>.json
+  def __init__(self, path: str):
+    self.path = path
+
+  def load(self, *parts: str) -> typing.Any:
+    with open(os.path.join(self.path, *parts)) as payload_file:
+      return json.load(payload_file)
+
+  def get_tasks(self) -> list:
+    return self.load('tasks.json')
+
+  def get_task(self, task_id: int) -> dict:
+    return self.load('jobs', f'{task_id}.json')
+
+  def get_job(self, pandaid: int) -> dict:
+    return self.load('job', f'{pandaid}.json')
+
+
+def filter_by_fields(records: list, params: dict, fields: list) -> list:
+  for field in fields:
+    if field in params:
+      records = [ record for record in records if str(record[field]) == params[field] ]
+  return records
+
+
+def filter_by_date(records: list, params: dict, time_key: str) -> list:
+  if 'date_from' in params:
+    records = [ record for record in records if params['date_from'] <= record[time_key][:10] <= params['date_to'] ]
+  if 'limit' in params:
+    records = records[:int(params['limit'])]
+  return records
+
+
+class BigpandaHandler(http.server.BaseHTTPRequestHandler):
+  payloads = None
+  requests = {}
+  latency = 0.
+  lock = threading.Lock()
+
+  def do_GET(self):
+    url = urllib.parse.urlsplit(self.path)
+    params = dict(urllib.parse.parse_qsl(url.query))
+    endpoint = url.path.strip('/')
+    with self.lock:
+      self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+    time.sleep(self.latency)
+
+    if endpoint == 'tasks':
+      data = filter_by_date(filter_by_fields(self.payloads.get_tasks(), params, [ 'jeditaskid' ]), params, 'creationdate')
+    elif endpoint == 'jobs':
+      task = self.payloads.get_task(int(params['jeditaskid']))
+      data = dict(task, jobs = filter_by_date(filter_by_fields(task['jobs'], params, [ 'prodsourcelabel' ]), params, 'creationtime'))
+    elif endpoint == 'job':
+      data = self.payloads.get_job(int(params['pandaid']))
+    else:
+      self.send_error(404)
+      return
+
+    body = json.dumps(data).encode()
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, *args):
+    pass
+
+
+class FileHandler(http.server.BaseHTTPRequestHandler):
+  # serves the replicas at /<rse>/<name>, with the range requests that resumed downloads rely on; the replicas on the
+  # RSEs where a file is not AVAILABLE are missing
+  def do_GET(self):
+    rse, name = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path).strip('/').split('/', 1)
+    if get_replica_states(name).get(rse) != 'AVAILABLE':
+      self.send_error(404)
+      return
+    content = get_file_content(name, FakeRucioClient.file_size)
+    offset = 0
+    range_match = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+    if range_match:
+      offset = int(range_match.group(1))
+      if offset >= len(content):
+        self.send_error(416)
+        return
+      self.send_response(206)
+      self.send_header('Content-Range', f'bytes {offset}-{len(content) - 1}/{len(content)}')
+    else:
+      self.send_response(200)
+    self.send_header('Content-Type', 'application/octet-stream')
+    self.send_header('Content-Length', str(len(content) - offset))
+    self.end_headers()
+    self.wfile.write(content[offset:])
+
+  def log_message(self, *args):
+    pass
+
+
+class FakeRucioClient:
+  num_files = 10
+  file_size = 1024**2
+  file_url = ''
+  latency = 0.
+
+  def __init__(self, *args, **kwargs):
+    pass
+
+  def list_files(self, scope: str, name: str, **kwargs):
+    time.sleep(self.latency)
+    for file_idx in range(self.num_files):
+      file_name = f'{name}._{file_idx:06d}.root'
+      yield {
+        'scope'   : scope,
+        'name'    : file_name,
+        'events'  : 1000 if name.endswith('.in') else None,
+        'bytes'   : self.file_size,
+        # the real checksum is only computed when the files are served, it would dominate the run time otherwise
+        'adler32' : f'{zlib.adler32(get_file_content(file_name, self.file_size)):08x}' if self.file_url else \
+                    f'{zlib.adler32(name.encode()) + file_idx:08x}'[-8:],
+      }
+
+  def list_replicas(self, dids: list, **kwargs):
+    time.sleep(self.latency)
+    for did in dids:
+      states = get_replica_states(did['name'])
+      replica = { 'scope' : did['scope'], 'name' : did['name'], 'states' : states }
+      if self.file_url:
+        replica['rses'] = { rse : [ f'{self.file_url}/{rse}/{urllib.parse.quote(did["name"])}' ] for rse in states }
+      yield replica
+
+
+def install_fake_rucio(num_files: int, latency: float = 0., file_url: str = '') -> None:
+  FakeRucioClient.num_files = num_files
+  FakeRucioClient.latency = latency
+  FakeRucioClient.file_url = file_url
+  rucio_module = types.ModuleType('rucio')
+  rucio_client_module = types.ModuleType('rucio.client')
+  rucio_client_module.Client = FakeRucioClient
+  rucio_module.client = rucio_client_module
+  sys.modules['rucio'] = rucio_module
+  sys.modules['rucio.client'] = rucio_client_module
+
+
+def run_pipeline(argv: list, num_files: int, latency: float, file_url: str, result_queue: multiprocessing.Queue) -> None:
+  # runs in a fresh interpreter, so that the peak RSS covers only the pipeline and not the stand-in servers
+  install_fake_rucio(num_files, latency, file_url)
+  os.environ['XDG_CACHE_HOME'] = tempfile.mkdtemp(prefix = 'pandavision_bench_')
+  sys.stdout = open(os.devnull, 'w')
+  import pandavision
+  start = time.perf_counter()
+  try:
+    pandavision.main(argv)
+  except BaseException as e:
+    # argparse exits with SystemExit on invalid arguments, which fails the run like any other error
+    result_queue.put({ 'error' : f'{type(e).__name__}: {e}' })
+    raise
+  wall_time = time.perf_counter() - start
+  result_queue.put({ 'wall_time' : wall_time, 'max_rss' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss })
+
+
+def wait_for_run(process: multiprocessing.Process, result_queue: multiprocessing.Queue) -> dict:
+  # a run that dies without reporting, e.g. because it is killed, must not block the benchmark
+  while True:
+    try:
+      return result_queue.get(timeout = 1.)
+    except queue.Empty:
+      if process.is_alive():
+        continue
+    try:
+      return result_queue.get(timeout = 1.)
+    except queue.Empty:
+      return { 'error' : f'pandavision.py exited with code {process.exitcode} without a result' }
+
+
+def get_args():
+  parser = argparse.ArgumentParser(
+    formatter_class = argparse.ArgumentDefaultsHelpFormatter,
+    description = 'Runs pandavision.py against local stand-ins of bigpanda and Rucio; ' \
+                  'the arguments after -- are passed on to pandavision.py',
+  )
+  parser.add_argument(
+    '-t', '--tasks', type = int, default = [ 10 ], nargs = '+',
+    help = 'Number of tasks',
+  )
+  parser.add_argument(
+    '-j', '--jobs', type = int, default = [ 100 ], nargs = '+',
+    help = 'Number of job chains per task',
+  )
+  parser.add_argument(
+    '-r', '--retries', type = int, default = [ 2 ], nargs = '+',
+    help = 'Number of failed attempts before the successful one in every job chain',
+  )
+  parser.add_argument(
+    '-f', '--files', type = int, default = [ 10 ], nargs = '+',
+    help = 'Number of files per dataset',
+  )
+  parser.add_argument(
+    '-l', '--latency', type = float, default = 0.,
+    help = 'Seconds added to every bigpanda request and Rucio call, to mimic the network',
+  )
+  parser.add_argument(
+    '-n', '--repeat', type = int, default = 1,
+    help = 'Number of times each configuration is run; the fastest run is reported',
+  )
+  parser.add_argument(
+    '-R', '--replay', type = str, default = '',
+    help = 'Directory with recorded bigpanda responses to serve instead of synthetic ones',
+  )
+  parser.add_argument(
+    '-o', '--output', type = str, default = '',
+    help = 'Write the results as JSON to this file',
+  )
+  argv = sys.argv[1:]
+  pandavision_argv = []
+  if '--' in argv:
+    separator_idx = argv.index('--')
+    argv, pandavision_argv = argv[:separator_idx], argv[separator_idx + 1:]
+  return parser.parse_args(argv), pandavision_argv
+
+
+if __name__ == '__main__':
+  args, pandavision_args = get_args()
+  context = multiprocessing.get_context('spawn')
+
+  # the replicas are served only for pandavision.py --download
+  file_server = None
+  file_url = ''
+  if any(arg.split('=', 1)[0] == '--download' for arg in pandavision_args):
+    file_server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FileHandler)
+    threading.Thread(target = file_server.serve_forever, daemon = True).start()
+    file_url = f'http://127.0.0.1:{file_server.server_port}'
+
+  results = []
+  for num_tasks, num_jobs, num_retries, num_files in itertools.product(args.tasks, args.jobs, args.retries, args.files):
+    if args.replay:
+      BigpandaHandler.payloads = RecordedPayloads(args.replay)
+    else:
+      BigpandaHandler.payloads = SyntheticPayloads(num_tasks, num_jobs, num_retries, num_files)
+    BigpandaHandler.latency = args.latency
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), BigpandaHandler)
+    server_thread = threading.Thread(target = server.serve_forever, daemon = True)
+    server_thread.start()
+
+    argv = [
+      '-u', BENCH_USER, '-d', str(BENCH_DAYS), '--bigpanda-url', f'http://127.0.0.1:{server.server_port}',
+      '--no-cache', '--rate', '0',
+    ] + pandavision_args
+    runs = []
+    for _ in range(args.repeat):
+      BigpandaHandler.requests = {}
+      result_queue = context.Queue()
+      process = context.Process(target = run_pipeline, args = (argv, num_files, args.latency, file_url, result_queue))
+      process.start()
+      runs.append(wait_for_run(process, result_queue))
+      process.join()
+      if 'error' in runs[-1]:
+        break
+    server.shutdown()
+    server.server_close()
+
+    result = {
+      'tasks'    : num_tasks,
+      'jobs'     : num_jobs,
+      'retries'  : num_retries,
+      'files'    : num_files,
+      'requests' : dict(BigpandaHandler.requests),
+    }
+    # a configuration fails as a whole if any of its runs fails
+    if 'error' in runs[-1]:
+      print(f'Configuration with {num_tasks} tasks, {num_jobs} chains/task, {num_retries} retries and {num_files} files failed: '
+            f'{runs[-1]["error"]}', file = sys.stderr)
+      result['error'] = runs[-1]['error']
+    else:
+      best_run = min(runs, key = lambda run: run['wall_time'])
+      result['wall_time'] = best_run['wall_time']
+      result['max_rss'] = best_run['max_rss']
+    results.append(result)
+
+  table_data = [ [ 'Tasks', 'Chains/task', 'Retries', 'Files', 'Requests', 'Wall time [s]', 'Peak RSS [MB]' ] ]
+  for result in results:
+    table_data.append([
+      result['tasks'],
+      result['jobs'],
+      result['retries'],
+      result['files'],
+      sum(result['requests'].values()),
+      f'{result["wall_time"]:.2f}' if 'error' not in result else 'failed',
+      f'{result["max_rss"] / 1024:.0f}' if 'error' not in result else 'failed',
+    ])
+  if file_server:
+    file_server.shutdown()
+    file_server.server_close()
+  print(tabulate.tabulate(table_data, headers = 'firstrow', tablefmt = 'rounded_outline'))
+
+  if args.output:
+    with open(args.output, 'w') as output_file:
+      json.dump(results, output_file, indent = 2)
+  if any('error' in result for result in results):
+    sys.exit(1)
@@ -2,11 +2,284 @@
 
 import sys
 import json
+import re
+import argparse
+import typing
 
-input_data = sys.stdin.read()
-try:
-  parsed_data = json.loads(input_data)
-  print(json.dumps(parsed_data, indent = 2))
-except ValueError as e:
-  print('Invalid JSON input:', e)
+CHUNK_SIZE = 64 * 1024
 
+WHITESPACE_RGX = re.compile(r'[ \t\n\r]*')
+SCALAR_RGX = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null')
+SCALAR_CHARS_RGX = re.compile(r'[0-9+\-.eEtrufalsn]*')
+PATH_SEGMENT_RGX = re.compile(r'^([^\[\]]*)((?:\[(?:\*|\d+)\])*)$')
+ALL_ITEMS = '*'
+
+
+class Tokenizer:
+  # reads the input in chunks and keeps only the unparsed remainder in memory, so the memory use does not depend on the
+  # size of the input but only on the size of its largest string or number; consecutive top-level values, as in NDJSON,
+  # are parsed one after another
+  def __init__(self, stream: typing.TextIO, chunk_size: int = CHUNK_SIZE):
+    self.stream = stream
+    self.chunk_size = chunk_size
+    self.buffer = ''
+    self.pos = 0
+
+  def fill(self) -> bool:
+    chunk = self.stream.read(self.chunk_size)
+    self.buffer = self.buffer[self.pos:] + chunk
+    self.pos = 0
+    return bool(chunk)
+
+  def peek(self) -> typing.Optional[str]:
+    while True:
+      self.pos = WHITESPACE_RGX.match(self.buffer, self.pos).end()
+      if self.pos < len(self.buffer):
+        return self.buffer[self.pos]
+      if not self.fill():
+        return None
+
+  def expect(self, char: str) -> None:
+    if self.peek() != char:
+      raise ValueError(f'Expected {char!r} at: {self.buffer[self.pos:self.pos + 20]!r}')
+    self.pos += 1
+
+  def read_string(self) -> str:
+    # an error may only mean that the string continues in the next chunk
+    while True:
+      try:
+        value, self.pos = json.decoder.scanstring(self.buffer, self.pos + 1)
+        return value
+      except ValueError:
+        if not self.fill():
+          raise
+
+  def read_scalar(self) -> typing.Any:
+    # a scalar runs up to the first character that cannot continue it, which may only come with a later chunk, and
+    # all of it has to be valid, e.g. 01 or 1. are not read as a shorter number
+    while SCALAR_CHARS_RGX.match(self.buffer, self.pos).end() == len(self.buffer) and self.fill():
+      pass
+    end = SCALAR_CHARS_RGX.match(self.buffer, self.pos).end()
+    match = SCALAR_RGX.fullmatch(self.buffer, self.pos, end)
+    if not match:
+      raise ValueError(f'Unexpected input: {self.buffer[self.pos:self.pos + 20]!r}')
+    self.pos = end
+    return json.loads(match.group())
+
+  def events(self) -> typing.Iterator[typing.Tuple[str, typing.Any]]:
+    # yields ('start_map', None), ('key', str), ('end_map', None), ('start_array', None), ('end_array', None) and
+    # ('value', scalar) events
+    stack = []
+    expect = 'value'
+    while True:
+      char = self.peek()
+      if char is None:
+        if stack:
+          raise ValueError('Unexpected end of input')
+        return
+      if expect in ('value', 'value_or_end'):
+        if expect == 'value_or_end' and char == ']':
+          self.pos += 1
+          stack.pop()
+          yield 'end_array', None
+        elif char == '{':
+          self.pos += 1
+          stack.append('{')
+          yield 'start_map', None
+          expect = 'key_or_end'
+          continue
+        elif char == '[':
+          self.pos += 1
+          stack.append('[')
+          yield 'start_array', None
+          expect = 'value_or_end'
+          continue
+        elif char == '"':
+          yield 'value', self.read_string()
+        else:
+          yield 'value', self.read_scalar()
+      elif expect in ('key', 'key_or_end'):
+        if expect == 'key_or_end' and char == '}':
+          self.pos += 1
+          stack.pop()
+          yield 'end_map', None
+        elif char == '"':
+          key = self.read_string()
+          self.expect(':')
+          yield 'key', key
+          expect = 'value'
+          continue
+        else:
+          raise ValueError(f'Expected a key at: {self.buffer[self.pos:self.pos + 20]!r}')
+      else:
+        closing = '}' if stack[-1] == '{' else ']'
+        if char == ',':
+          self.pos += 1
+          expect = 'key' if stack[-1] == '{' else 'value'
+          continue
+        if char != closing:
+          raise ValueError(f'Expected {closing!r} or \',\' at: {self.buffer[self.pos:self.pos + 20]!r}')
+        self.pos += 1
+        stack.pop()
+        yield ('end_map' if closing == '}' else 'end_array'), None
+      expect = 'comma_or_end' if stack else 'value'
+
+
+def build_value(event: tuple, events: typing.Iterator[tuple]) -> typing.Any:
+  kind, value = event
+  if kind == 'value':
+    return value
+  if kind == 'start_map':
+    result = {}
+    for event in events:
+      if event[0] == 'end_map':
+        return result
+      result[event[1]] = build_value(next(events), events)
+  result = []
+  for event in events:
+    if event[0] == 'end_array':
+      return result
+    result.append(build_value(event, events))
+
+
+def skip_value(event: tuple, events: typing.Iterator[tuple]) -> None:
+  depth = 0
+  while True:
+    if event[0] in ('start_map', 'start_array'):
+      depth += 1
+    elif event[0] in ('end_map', 'end_array'):
+      depth -= 1
+    if depth == 0:
+      return
+    event = next(events)
+
+
+class Printer:
+  # writes the values as they are parsed, in the same layout as json.dumps
+  def __init__(self, out: typing.TextIO, indent: typing.Optional[int] = 2):
+    self.out = out
+    self.indent = indent
+
+  def newline(self, level: int) -> None:
+    if self.indent is not None:
+      self.out.write('\n' + ' ' * (self.indent * level))
+
+  def write_events(self, event: tuple, events: typing.Iterator[tuple], level: int = 0) -> None:
+    kind, value = event
+    if kind == 'value':
+      self.out.write(json.dumps(value))
+      return
+    is_map = kind == 'start_map'
+    end_kind = 'end_map' if is_map else 'end_array'
+    self.out.write('{' if is_map else '[')
+    num_items = 0
+    for event in events:
+      if event[0] == end_kind:
+        break
+      if num_items:
+        self.out.write(',' if self.indent is not None else ', ')
+      self.newline(level + 1)
+      if is_map:
+        self.out.write(f'{json.dumps(event[1])}: ')
+        event = next(events)
+      self.write_events(event, events, level + 1)
+      num_items += 1
+    if num_items:
+      self.newline(level)
+    self.out.write('}' if is_map else ']')
+
+  def write_value(self, value: typing.Any) -> None:
+    self.out.write(json.dumps(value, indent = self.indent) + '\n')
+
+
+def parse_path(path: str) -> list:
+  # e.g. jobs[*].pandaid,computingsite selects the pandaid and computingsite fields of every element of jobs
+  segments = []
+  parts = path.lstrip('.').split('.') if path.lstrip('.') else []
+  for part_idx, part in enumerate(parts):
+    match = PATH_SEGMENT_RGX.match(part)
+    if not match:
+      raise ValueError(f'Invalid path segment: {part}')
+    name, indices = match.groups()
+    if ',' in name:
+      if indices or part_idx < len(parts) - 1:
+        raise ValueError(f'Multiple fields can only be selected in the last path segment: {part}')
+      segments.append(tuple(name.split(',')))
+    elif name:
+      segments.append(name)
+    for index in re.findall(r'\[(\*|\d+)\]', indices):
+      segments.append(ALL_ITEMS if index == ALL_ITEMS else int(index))
+  return segments
+
+
+def select(event: tuple, events: typing.Iterator[tuple], segments: list, emit: typing.Callable[[typing.Any], None]) -> None:
+  # only the selected values are built in memory, everything else is skipped as it is parsed
+  if not segments:
+    emit(build_value(event, events))
+    return
+  segment, remaining = segments[0], segments[1:]
+  kind = event[0]
+  if segment == ALL_ITEMS or isinstance(segment, int):
+    if kind != 'start_array':
+      skip_value(event, events)
+      return
+    for item_idx, event in enumerate(events):
+      if event[0] == 'end_array':
+        break
+      if segment in (ALL_ITEMS, item_idx):
+        select(event, events, remaining, emit)
+      else:
+        skip_value(event, events)
+  elif kind == 'start_map':
+    record = {}
+    for event in events:
+      if event[0] == 'end_map':
+        break
+      key, event = event[1], next(events)
+      if isinstance(segment, tuple) and key in segment:
+        record[key] = build_value(event, events)
+      elif key == segment:
+        select(event, events, remaining, emit)
+      else:
+        skip_value(event, events)
+    if record:
+      emit({ key : record[key] for key in segment if key in record })
+  else:
+    skip_value(event, events)
+
+
+def get_args() -> argparse.Namespace:
+  parser = argparse.ArgumentParser(
+    formatter_class = argparse.ArgumentDefaultsHelpFormatter,
+    description = 'Pretty-prints JSON or NDJSON from stdin as it is read',
+  )
+  parser.add_argument(
+    'path', type = str, nargs = '?', default = '',
+    help = 'Print only the values at this path, e.g. jobs[*].pandaid,computingsite',
+  )
+  parser.add_argument(
+    '-c', '--compact', action = 'store_true', default = False,
+    help = 'Print every value on a single line',
+  )
+  parser.add_argument(
+    '-i', '--indent', type = int, default = 2,
+    help = 'Number of spaces to indent with',
+  )
+  return parser.parse_args()
+
+
+if __name__ == '__main__':
+  args = get_args()
+  printer = Printer(sys.stdout, None if args.compact else args.indent)
+  segments = parse_path(args.path)
+  events = Tokenizer(sys.stdin).events()
+  try:
+    for event in events:
+      if segments:
+        select(event, events, segments, printer.write_value)
+      else:
+        printer.write_events(event, events)
+        sys.stdout.write('\n')
+  except ValueError as e:
+    sys.stdout.flush()
+    sys.exit(f'\nInvalid JSON input: {e}')